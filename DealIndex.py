@@ -0,0 +1,152 @@
+import argparse
+import math
+import random
+import struct
+import sys
+
+from array import array
+
+from Seahaven import Seahaven
+from Solver import Solver, DEFAULT_TABLE_BYTES
+from TranspositionTable import TranspositionTable
+
+
+DIFFICULTIES = ["easy", "medium", "hard", "expert"]
+DEFAULT_DIFFICULTY = "medium"
+
+# File layout (all integers little-endian):
+#   magic (4 bytes), version (uint16), number of buckets (uint16)
+#   one uint32 deal count per bucket
+#   the deal numbers of each bucket in turn, as uint32
+INDEX_MAGIC = b'SHDI'
+INDEX_VERSION = 1
+HEADER_FORMAT = '<4sHH'
+
+
+def difficulty_score(solution_length, nodes, cell_pressure):
+	'''
+	Combines the length of a solution, the number of positions the solver
+	searched to find it and the average number of occupied free cells along it
+	into one number. Higher means harder.
+	'''
+	return solution_length + 8*math.log2(1 + nodes) + 10*cell_pressure
+
+
+def score_deal(deal, solver_args):
+	'''
+	Solves deal and returns its difficulty score, or None if the solver found no
+	solution (the deal may be unsolvable).
+	'''
+	game = Seahaven(deal=deal)
+	solver = Solver.from_game(game, **solver_args)
+	solution = solver.solve()
+	if solution is None:
+		return None
+	return difficulty_score(len(solution), solver.nodes, solver.cell_pressure(solution))
+
+
+def bucket_deals(scored_deals):
+	'''
+	scored_deals is a list of (score, deal) tuples. Returns a list with one list
+	of deal numbers per difficulty, splitting the deals into equal-sized groups
+	by score.
+	'''
+	scored_deals = sorted(scored_deals)
+	buckets = [[] for _ in DIFFICULTIES]
+	for (i, (_, deal)) in enumerate(scored_deals):
+		buckets[i * len(DIFFICULTIES) // len(scored_deals)].append(deal)
+	return buckets
+
+
+class DealIndex (object):
+	'''
+	Solvable deal numbers grouped by difficulty, as written by the offline job
+	in this module. pick() returns a deal in constant time, so starting a new
+	game never has to run the solver.
+	'''
+
+	def __init__(self, buckets):
+		# one array of deal numbers per difficulty in DIFFICULTIES
+		self.buckets = [array('I', bucket) for bucket in buckets]
+
+	@classmethod
+	def load(cls, path):
+		with open(path, 'rb') as index_file:
+			data = index_file.read()
+		(magic, version, num_buckets) = struct.unpack_from(HEADER_FORMAT, data)
+		if magic != INDEX_MAGIC or version != INDEX_VERSION:
+			raise ValueError("not a deal index file: %s" % path)
+		offset = struct.calcsize(HEADER_FORMAT)
+		counts = struct.unpack_from('<%dI' % num_buckets, data, offset)
+		offset += 4*num_buckets
+		buckets = []
+		for count in counts:
+			bucket = array('I')
+			bucket.frombytes(data[offset:offset + 4*count])
+			if sys.byteorder == 'big':
+				bucket.byteswap()
+			buckets.append(bucket)
+			offset += 4*count
+		return cls(buckets)
+
+	def save(self, path):
+		with open(path, 'wb') as index_file:
+			index_file.write(struct.pack(HEADER_FORMAT, INDEX_MAGIC, INDEX_VERSION, len(self.buckets)))
+			index_file.write(struct.pack('<%dI' % len(self.buckets), *[len(b) for b in self.buckets]))
+			for bucket in self.buckets:
+				if sys.byteorder == 'big':
+					bucket = array('I', bucket)
+					bucket.byteswap()
+				index_file.write(bucket.tobytes())
+
+	def pick(self, difficulty=DEFAULT_DIFFICULTY, rng=random):
+		'''
+		Returns a random solvable deal number of the given difficulty (one of
+		DIFFICULTIES). If the index has none of that difficulty, the deal comes
+		from the nearest difficulty that has some, the easier one first on a
+		tie. Returns None only if the index is empty.
+		'''
+		wanted = DIFFICULTIES.index(difficulty)
+		by_distance = sorted(range(len(DIFFICULTIES)), key=lambda i: (abs(i - wanted), i))
+		for i in by_distance:
+			bucket = self.buckets[i]
+			if len(bucket) > 0:
+				return bucket[rng.randrange(len(bucket))]
+		return None
+
+	def __len__(self):
+		return sum(len(bucket) for bucket in self.buckets)
+
+
+def build_index(first, count, max_nodes, progress=None):
+	'''
+	Scores deals first..first+count-1 and returns a DealIndex of the ones the
+	solver could solve.
+	'''
+	solver_args = {"max_nodes": max_nodes, "table": TranspositionTable(DEFAULT_TABLE_BYTES)}
+	scored_deals = []
+	for deal in range(first, first + count):
+		score = score_deal(deal, solver_args)
+		if score is not None:
+			scored_deals.append((score, deal))
+		if progress:
+			progress(deal, score)
+	return DealIndex(bucket_deals(scored_deals))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Build the deal difficulty index.")
+	parser.add_argument("--first", type=int, default=0, help="first deal number to score")
+	parser.add_argument("--count", type=int, default=1000, help="number of deals to score")
+	parser.add_argument("--max-nodes", type=int, default=50000, help="solver node limit per deal")
+	parser.add_argument("--output", default="deal_index.bin", help="index file to write")
+	args = parser.parse_args()
+
+	def report(deal, score):
+		status = "unsolved" if score is None else "%.1f" % score
+		print("deal %d: %s" % (deal, status))
+
+	index = build_index(args.first, args.count, args.max_nodes, report)
+	index.save(args.output)
+	for (difficulty, bucket) in zip(DIFFICULTIES, index.buckets):
+		print("%s: %d deals" % (difficulty, len(bucket)))
@@ -0,0 +1,306 @@
+'''
+Differential fuzzer: plays random and adversarial move sequences, including
+illegal moves, undo and redo, against the reference Seahaven class and every
+fast engine in ENGINES in lockstep, and compares them after every step.
+
+	python DifferentialFuzz.py [--steps N] [--workers N] [--seed N]
+
+Each step compares the full state (slots, empty_cells_count, move history,
+redo stack) and whether the move was accepted. The reference is also checked
+against a few invariants, and every so often each move the Solver would
+generate is checked against Seahaven.move(). A failing sequence is shrunk to a
+minimal one before it is reported. Exits with status 1 on failure.
+'''
+
+import argparse
+import contextlib
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+from Seahaven import Seahaven, NUM_DEALS, NUM_TOWERS, NUM_CELLS, Rank
+from Solver import Solver, encode_card
+
+
+FIRST_CELL = NUM_TOWERS
+FIRST_SUIT = NUM_TOWERS + NUM_CELLS
+
+# ops are tuples: (MOVE, source, dest, count), (UNDO,) or (REDO,)
+MOVE = 0
+UNDO = 1
+REDO = 2
+
+# steps played from one deal before starting on a new one
+STEPS_PER_GAME = 300
+
+
+def game_state(game):
+	'''
+	Returns everything observable about game (slots, empty_cells_count, move
+	history and redo stack) as a bytes object, so states compare quickly.
+	'''
+	return game.to_bytes()
+
+
+def apply_op(game, op):
+	if op[0] == MOVE:
+		return game.move(op[1], op[2], op[3])
+	if op[0] == UNDO:
+		game.undo()
+	else:
+		game.redo()
+	return None
+
+
+class ReferenceEngine (object):
+	'''
+	The Seahaven class itself. Every other engine is compared against this.
+	'''
+
+	def __init__(self, deal):
+		self.game = Seahaven(deal=deal)
+
+	def step(self, op):
+		return apply_op(self.game, op)
+
+	def state(self):
+		return game_state(self.game)
+
+
+class PackedEngine (object):
+	'''
+	Keeps the game only in its packed form (Seahaven.to_bytes()), unpacking it
+	for each step and packing it again afterwards, as SeahavenServer.py does
+	for idle sessions.
+	'''
+
+	def __init__(self, deal):
+		self.data = Seahaven(deal=deal).to_bytes()
+
+	def step(self, op):
+		game = Seahaven(packed=self.data)
+		result = apply_op(game, op)
+		self.data = game.to_bytes()
+		return result
+
+	def state(self):
+		return self.data
+
+
+# fast engines to compare against ReferenceEngine, by name
+ENGINES = {
+	"packed": PackedEngine,
+}
+
+
+def random_op(rng, game):
+	'''
+	Returns a random op for game. Most are plausible moves, built around the
+	cards actually in play, so a fair share are legal; the rest are undo, redo
+	and arbitrary moves, including out-of-range slots and counts.
+	'''
+	r = rng.random()
+	if r < 0.08:
+		return (UNDO,)
+	if r < 0.13:
+		return (REDO,)
+	if r < 0.3:
+		return (MOVE, rng.randrange(-1, 19), rng.randrange(-1, 19), rng.randrange(0, 7))
+
+	slots = game.slots
+	sources = [i for i in range(FIRST_SUIT) if slots[i]]
+	if not sources:
+		return (UNDO,)
+	source = rng.choice(sources)
+	count = rng.randint(1, min(len(slots[source]), 6))
+	card = slots[source][-count]
+
+	r = rng.random()
+	if r < 0.5:
+		# a tower whose top card accepts card, if there is one
+		dests = [i for i in range(NUM_TOWERS) if slots[i] and slots[i][-1].suit == card.suit
+			and slots[i][-1].rank == card.rank + 1]
+		if dests:
+			return (MOVE, source, rng.choice(dests), count)
+	if r < 0.7 and card.rank == Rank.king:
+		dests = [i for i in range(NUM_TOWERS) if not slots[i]]
+		if dests:
+			return (MOVE, source, rng.choice(dests), count)
+	return (MOVE, source, rng.randrange(18), count)
+
+
+def check_invariants(game):
+	'''
+	Returns a description of the first broken invariant of game, or None.
+	'''
+	empty_cells = sum(1 for i in range(FIRST_CELL, FIRST_SUIT) if not game.slots[i])
+	if game.empty_cells_count != empty_cells:
+		return "empty_cells_count is %d but %d cells are empty" % (game.empty_cells_count, empty_cells)
+	cards = [encode_card(c) for slot in game.slots for c in slot]
+	if len(cards) != 52 or len(set(cards)) != 52:
+		return "cards lost or duplicated"
+	for i in range(FIRST_CELL, FIRST_SUIT):
+		if len(game.slots[i]) > 1:
+			return "cell %d holds %d cards" % (i, len(game.slots[i]))
+	for suit in range(4):
+		ranks = [c.rank for c in game.slot_for_suit(suit)]
+		if ranks != list(range(1, len(ranks) + 1)) or any(c.suit != suit for c in game.slot_for_suit(suit)):
+			return "suit stack %d out of order" % suit
+	return None
+
+
+def check_solver_moves(game):
+	'''
+	Checks that every move Solver generates from the position of game is
+	accepted by Seahaven.move() and leads to the same position. Returns a
+	description of the first mismatch, or None.
+	'''
+	solver = Solver.from_game(game)
+	for move in solver.legal_moves():
+		copy = Seahaven(packed=game.to_bytes())
+		if not copy.move(*move):
+			return "Seahaven rejects solver move %r" % (move,)
+		done = solver.apply(move)
+		slots = tuple(tuple(slot) for slot in solver.slots)
+		solver.revert(done)
+		if slots != tuple(tuple(encode_card(c) for c in slot) for slot in copy.slots):
+			return "solver move %r leads to a different position" % (move,)
+	return None
+
+
+def replay(deal, ops, engine_names, solver_every=0):
+	'''
+	Plays ops from deal on the reference and the named engines. Returns
+	(step, description) for the first mismatch, or None if there was none.
+	Step is the number of ops played when the mismatch was found.
+	'''
+	reference = ReferenceEngine(deal)
+	engines = [(name, ENGINES[name](deal)) for name in engine_names]
+	for (name, engine) in engines:
+		if engine.state() != reference.state():
+			return (0, "%s: initial state differs" % name)
+
+	for (step, op) in enumerate(ops, 1):
+		expected = reference.step(op)
+		expected_state = reference.state()
+		for (name, engine) in engines:
+			result = engine.step(op)
+			if result != expected:
+				return (step, "%s: %r returned %r, reference returned %r" % (name, op, result, expected))
+			if engine.state() != expected_state:
+				return (step, "%s: state differs after %r" % (name, op))
+		problem = check_invariants(reference.game)
+		if problem:
+			return (step, "reference: %s after %r" % (problem, op))
+		if solver_every and step % solver_every == 0:
+			problem = check_solver_moves(reference.game)
+			if problem:
+				return (step, problem)
+	return None
+
+
+def minimize(deal, ops, engine_names, solver_every):
+	'''
+	Shrinks the failing sequence ops by repeatedly dropping chunks of it
+	(delta debugging) for as long as it keeps failing. Returns the smallest
+	failing sequence found.
+	'''
+	def fails(candidate):
+		return replay(deal, candidate, engine_names, solver_every and 1) is not None
+
+	failure = replay(deal, ops, engine_names, solver_every and 1)
+	if failure:
+		ops = ops[:failure[0]]
+	chunk = max(len(ops) // 2, 1)
+	while chunk >= 1:
+		i = 0
+		shrunk = False
+		while i < len(ops):
+			candidate = ops[:i] + ops[i+chunk:]
+			if candidate != ops and fails(candidate):
+				ops = candidate
+				shrunk = True
+			else:
+				i += chunk
+		if not shrunk:
+			chunk //= 2
+	return ops
+
+
+def fuzz(seed, steps, engine_names, solver_every):
+	'''
+	Plays about steps random ops, starting a new deal every STEPS_PER_GAME.
+	Returns (steps played, failure), where failure is None or a tuple of
+	(deal, minimized ops, description).
+	'''
+	rng = random.Random(seed)
+	played = 0
+	while played < steps:
+		deal = rng.randrange(NUM_DEALS)
+		reference = ReferenceEngine(deal)
+		engines = [ENGINES[name](deal) for name in engine_names]
+		ops = []
+		for _ in range(min(STEPS_PER_GAME, steps - played)):
+			op = random_op(rng, reference.game)
+			ops.append(op)
+			played += 1
+			expected = reference.step(op)
+			expected_state = reference.state()
+			mismatch = any(engine.step(op) != expected or engine.state() != expected_state for engine in engines)
+			mismatch = mismatch or check_invariants(reference.game) is not None
+			if not mismatch and solver_every and played % solver_every == 0:
+				mismatch = check_solver_moves(reference.game) is not None
+			if mismatch:
+				ops = minimize(deal, ops, engine_names, solver_every)
+				(_, description) = replay(deal, ops, engine_names, solver_every and 1)
+				return (played, (deal, ops, description))
+	return (played, None)
+
+
+def fuzz_quietly(args):
+	# Seahaven.move() prints a line for every illegal move; the fuzzer plays
+	# a great many of those.
+	with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+		return fuzz(*args)
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Differential fuzzing of Seahaven engines.")
+	parser.add_argument("--steps", type=int, default=1000000, help="total steps to play")
+	parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+	parser.add_argument("--seed", type=int, default=None, help="base random seed")
+	parser.add_argument("--engines", default=",".join(ENGINES), help="comma-separated engines to compare")
+	parser.add_argument("--solver-every", type=int, default=50, help="check solver moves every N steps (0 for never)")
+	args = parser.parse_args()
+
+	engine_names = [name for name in args.engines.split(",") if name]
+	base_seed = args.seed if args.seed is not None else random.randrange(2**32)
+	chunk_steps = 20000
+	num_chunks = max(1, (args.steps + chunk_steps - 1) // chunk_steps)
+	jobs = [(base_seed + i, chunk_steps, engine_names, args.solver_every) for i in range(num_chunks)]
+
+	print("fuzzing %s against reference, base seed %d" % (", ".join(engine_names) or "nothing", base_seed))
+	start = time.perf_counter()
+	total = 0
+	failure = None
+	with multiprocessing.Pool(args.workers) as pool:
+		for (played, failure) in pool.imap_unordered(fuzz_quietly, jobs):
+			total += played
+			if failure:
+				pool.terminate()
+				break
+	elapsed = time.perf_counter() - start
+	print("%d steps in %.1f s (%.0f steps/minute)" % (total, elapsed, total / elapsed * 60))
+
+	if failure:
+		(deal, ops, description) = failure
+		print("FAIL: %s" % description)
+		print("deal %d, %d ops: %r" % (deal, len(ops), ops))
+		return 1
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,310 @@
+'''
+Endgame table: exact results for every position with at most K cards left in
+play (not on the suit stacks).
+
+	python EndgameTable.py [--max-cards K] [--output endgame.bin]
+
+The offline job in this module enumerates every such position that can be at
+rest (no card waiting to be moved to its suit stack automatically), works out
+its distance to a win by retrograde analysis, and writes the results to a
+file indexed by a minimal perfect hash of the position's key (the same key as
+Solver.position_key()). EndgameTable opens that file memory-mapped, so it
+costs nothing until it is probed, and Solver uses it to stop searching as
+soon as a position falls inside it.
+'''
+
+import argparse
+import heapq
+import mmap
+import struct
+import sys
+
+from array import array
+from itertools import combinations, permutations
+
+from Seahaven import NUM_TOWERS, NUM_CELLS
+from Solver import Solver, FIRST_SUIT, NUM_SLOTS_TOTAL, ALL_CARDS_COUNT
+
+
+DEFAULT_MAX_CARDS = 6
+
+# probe() result for positions that can't be won
+LOSS = -1
+
+# File layout (all integers little-endian):
+#   magic (4 bytes), version (uint16), max cards (uint16),
+#   number of positions (uint32), number of hash buckets (uint32)
+#   one uint32 displacement per bucket
+#   one uint32 key fingerprint per position
+#   one uint8 distance to win per position (NO_WIN_DISTANCE if lost)
+TABLE_MAGIC = b'SHEG'
+TABLE_VERSION = 1
+HEADER_FORMAT = '<4sHHII'
+NO_WIN_DISTANCE = 255
+
+# average number of keys per hash bucket while building the perfect hash
+KEYS_PER_BUCKET = 4
+
+MASK_64 = 0xFFFFFFFFFFFFFFFF
+
+
+def mix(x):
+	'''
+	splitmix64 finalizer: scrambles the bits of a 64-bit integer.
+	'''
+	x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9 & MASK_64
+	x = (x ^ (x >> 27)) * 0x94D049BB133111EB & MASK_64
+	return x ^ (x >> 31)
+
+
+def bucket_for_key(key, num_buckets):
+	return mix(key) % num_buckets
+
+
+def slot_for_key(key, displacement, num_keys):
+	return mix(key ^ ((displacement + 1) * 0x9E3779B97F4A7C15 & MASK_64)) % num_keys
+
+
+def fingerprint(key):
+	return key >> 32
+
+
+def build_perfect_hash(keys):
+	'''
+	Builds a minimal perfect hash of the distinct 64-bit keys (hash and
+	displace). Returns (displacements, slots): displacements is an array with
+	one entry per bucket, and slots[i] is the slot of keys[i].
+	'''
+	num_keys = len(keys)
+	num_buckets = max(1, num_keys // KEYS_PER_BUCKET)
+	buckets = [[] for _ in range(num_buckets)]
+	for (i, key) in enumerate(keys):
+		buckets[bucket_for_key(key, num_buckets)].append(i)
+
+	displacements = array('I', bytes(4 * num_buckets))
+	slots = [0] * num_keys
+	taken = bytearray(num_keys)
+	# place the biggest buckets first, while the table is still empty
+	for bucket_index in sorted(range(num_buckets), key=lambda b: -len(buckets[b])):
+		bucket = buckets[bucket_index]
+		if not bucket:
+			continue
+		displacement = 0
+		while True:
+			candidate = [slot_for_key(keys[i], displacement, num_keys) for i in bucket]
+			if len(set(candidate)) == len(candidate) and not any(taken[s] for s in candidate):
+				break
+			displacement += 1
+		displacements[bucket_index] = displacement
+		for (i, s) in zip(bucket, candidate):
+			slots[i] = s
+			taken[s] = 1
+	return (displacements, slots)
+
+
+def sequence_partitions(cards):
+	'''
+	Yields every way of splitting cards into unordered groups of ordered
+	sequences (the possible contents of interchangeable towers).
+	'''
+	if not cards:
+		yield []
+		return
+	first = cards[0]
+	rest = cards[1:]
+	for size in range(len(rest) + 1):
+		for others in combinations(rest, size):
+			remaining = [c for c in rest if c not in others]
+			for tower in permutations((first,) + others):
+				for partition in sequence_partitions(remaining):
+					yield [list(tower)] + partition
+
+
+def suit_distributions(max_cards):
+	'''
+	Yields (c0, c1, c2, c3): the number of cards of each suit still in play,
+	for every total up to max_cards.
+	'''
+	for c0 in range(min(max_cards, 13) + 1):
+		for c1 in range(min(max_cards - c0, 13) + 1):
+			for c2 in range(min(max_cards - c0 - c1, 13) + 1):
+				for c3 in range(min(max_cards - c0 - c1 - c2, 13) + 1):
+					yield (c0, c1, c2, c3)
+
+
+def positions_with_cards(counts):
+	'''
+	Yields the slots (18 lists of card codes, as in Solver.slots) of every
+	position at rest whose cards in play are the top counts[suit] ranks of each
+	suit. Towers and cells are interchangeable, so each layout is produced
+	once, with cards in the lowest-numbered towers and cells.
+	'''
+	in_play = [rank*4 + suit for suit in range(4) for rank in range(14 - counts[suit], 14)]
+	foundations = [[rank*4 + suit for rank in range(1, 14 - counts[suit])] for suit in range(4)]
+	# the cards the suit stacks are waiting for; none may be exposed
+	next_cards = set((14 - counts[suit])*4 + suit for suit in range(4) if counts[suit])
+
+	for num_cells in range(min(NUM_CELLS, len(in_play)) + 1):
+		for cells in combinations(in_play, num_cells):
+			if next_cards.intersection(cells):
+				continue
+			rest = [c for c in in_play if c not in cells]
+			for towers in sequence_partitions(rest):
+				if len(towers) > NUM_TOWERS or any(tower[-1] in next_cards for tower in towers):
+					continue
+				slots = towers + [[] for _ in range(NUM_TOWERS - len(towers))]
+				slots += [[c] for c in cells] + [[] for _ in range(NUM_CELLS - num_cells)]
+				slots += [list(f) for f in foundations]
+				yield slots
+
+
+def cards_in_play(solver):
+	return ALL_CARDS_COUNT - sum(len(solver.slots[i]) for i in range(FIRST_SUIT, NUM_SLOTS_TOTAL))
+
+
+def build_table(max_cards, progress=None):
+	'''
+	Works out the distance to a win of every position at rest with up to
+	max_cards cards in play. Returns a dict of position key -> distance (or
+	LOSS).
+
+	Positions are solved in order of cards in play. A move either stays at the
+	same number of cards (tower and cell shuffling) or drops to fewer, whose
+	distances are already known, so each level is a shortest-path problem with
+	known costs at its exits.
+	'''
+	solver = Solver([[] for _ in range(NUM_SLOTS_TOTAL)])
+	distances = {}
+
+	for num_cards in range(max_cards + 1):
+		keys = []
+		index_for_key = {}
+		exit_costs = []
+		successors = []
+		for counts in suit_distributions(max_cards):
+			if sum(counts) != num_cards:
+				continue
+			for slots in positions_with_cards(counts):
+				solver.slots = slots
+				key = solver.position_key()
+				index_for_key[key] = len(keys)
+				keys.append(key)
+				best_exit = 0 if num_cards == 0 else None
+				same_level = []
+				for move in solver.legal_moves():
+					done = solver.apply(move)
+					child_key = solver.position_key()
+					if cards_in_play(solver) < num_cards:
+						child_distance = distances[child_key]
+						if child_distance != LOSS and (best_exit is None or child_distance + 1 < best_exit):
+							best_exit = child_distance + 1
+					else:
+						same_level.append(child_key)
+					solver.revert(done)
+				exit_costs.append(best_exit)
+				successors.append(same_level)
+
+		# Dijkstra from the exits, walking same-level moves backwards
+		predecessors = [[] for _ in keys]
+		for (i, same_level) in enumerate(successors):
+			for child_key in same_level:
+				predecessors[index_for_key[child_key]].append(i)
+		level_distances = [None] * len(keys)
+		queue = [(cost, i) for (i, cost) in enumerate(exit_costs) if cost is not None]
+		heapq.heapify(queue)
+		while queue:
+			(cost, i) = heapq.heappop(queue)
+			if level_distances[i] is not None:
+				continue
+			level_distances[i] = cost
+			for j in predecessors[i]:
+				if level_distances[j] is None:
+					heapq.heappush(queue, (cost + 1, j))
+
+		for (key, distance) in zip(keys, level_distances):
+			distances[key] = LOSS if distance is None else distance
+		if progress:
+			progress(num_cards, len(keys))
+	return distances
+
+
+def write_table(path, distances, max_cards):
+	keys = list(distances)
+	(displacements, slots) = build_perfect_hash(keys)
+	fingerprints = array('I', bytes(4 * len(keys)))
+	values = bytearray(len(keys))
+	for (key, s) in zip(keys, slots):
+		fingerprints[s] = fingerprint(key)
+		distance = distances[key]
+		values[s] = NO_WIN_DISTANCE if distance == LOSS else min(distance, NO_WIN_DISTANCE - 1)
+	if sys.byteorder == 'big':
+		displacements.byteswap()
+		fingerprints.byteswap()
+	with open(path, 'wb') as table_file:
+		table_file.write(struct.pack(HEADER_FORMAT, TABLE_MAGIC, TABLE_VERSION, max_cards, len(keys), len(displacements)))
+		table_file.write(displacements.tobytes())
+		table_file.write(fingerprints.tobytes())
+		table_file.write(bytes(values))
+
+
+class EndgameTable (object):
+	'''
+	Read-only, memory-mapped view of a table written by this module.
+
+	A key that isn't in the table can, very rarely, match the 32-bit
+	fingerprint stored in its slot. probe() only looks up positions with at
+	most max_cards cards in play, which are all in the table, so this can't
+	happen there.
+	'''
+
+	def __init__(self, path):
+		with open(path, 'rb') as table_file:
+			self.map = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+		(magic, version, self.max_cards, self.num_keys, self.num_buckets) = struct.unpack_from(HEADER_FORMAT, self.map)
+		if magic != TABLE_MAGIC or version != TABLE_VERSION:
+			raise ValueError("not an endgame table file: %s" % path)
+		if sys.byteorder == 'big':
+			raise ValueError("endgame tables can only be memory-mapped on little-endian machines")
+		view = memoryview(self.map)
+		offset = struct.calcsize(HEADER_FORMAT)
+		self.displacements = view[offset:offset + 4*self.num_buckets].cast('I')
+		offset += 4*self.num_buckets
+		self.fingerprints = view[offset:offset + 4*self.num_keys].cast('I')
+		offset += 4*self.num_keys
+		self.values = view[offset:offset + self.num_keys]
+
+	def lookup(self, key):
+		'''
+		Returns the distance to a win of the position with key, LOSS if it can't
+		be won, or None if the key isn't in the table.
+		'''
+		displacement = self.displacements[bucket_for_key(key, self.num_buckets)]
+		s = slot_for_key(key, displacement, self.num_keys)
+		if self.fingerprints[s] != fingerprint(key):
+			return None
+		value = self.values[s]
+		return LOSS if value == NO_WIN_DISTANCE else value
+
+	def probe(self, solver):
+		'''
+		Looks up the current position of solver (a Solver). Returns None if it
+		has too many cards in play to be in the table.
+		'''
+		if cards_in_play(solver) > self.max_cards:
+			return None
+		return self.lookup(solver.position_key())
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Build the endgame table.")
+	parser.add_argument("--max-cards", type=int, default=DEFAULT_MAX_CARDS, help="most cards in play to cover")
+	parser.add_argument("--output", default="endgame.bin", help="table file to write")
+	args = parser.parse_args()
+
+	def report(num_cards, count):
+		print("%d cards in play: %d positions" % (num_cards, count))
+
+	distances = build_table(args.max_cards, report)
+	write_table(args.output, distances, args.max_cards)
+	losses = sum(1 for d in distances.values() if d == LOSS)
+	print("%d positions, %d lost, written to %s" % (len(distances), losses, args.output))
@@ -0,0 +1,235 @@
+'''
+Exports game histories to columnar files and summarizes them.
+
+	python HistoryExport.py export OUT_DIR GAME_FILE...
+	python HistoryExport.py summarize OUT_DIR
+
+Games are read from JSON save files (Seahaven.to_dict()) or packed session
+files (Seahaven.to_bytes(), as stored by SeahavenServer.py) straight from
+their raw data, without building Card or Seahaven objects. OUT_DIR gets one
+.npy file per column, in two tables:
+
+	moves_<column>.npy, one row per move: game, deal, index, source, dest,
+	count, is_auto, undone (undone moves are the ones on the redo stack)
+
+	games_<column>.npy, one row per game: deal, moves, undone, won
+
+The files are written without NumPy and can be memory-mapped with
+numpy.load(path, mmap_mode='r'). Summarizing needs NumPy.
+'''
+
+import json
+import os
+import struct
+import sys
+
+from array import array
+
+from Seahaven import PACKED_VERSION, PACKED_HEADER, PACKED_COUNTS, NO_DEAL, AUTO_MOVE_FLAG, NUM_TOWERS, NUM_CELLS
+
+
+# table name -> list of (column name, array typecode, NumPy dtype)
+MOVE_COLUMNS = [
+	("game", 'I', '<u4'),
+	("deal", 'I', '<u4'),
+	("index", 'I', '<u4'),
+	("source", 'B', '|u1'),
+	("dest", 'B', '|u1'),
+	("count", 'B', '|u1'),
+	("is_auto", 'B', '|b1'),
+	("undone", 'B', '|b1'),
+]
+GAME_COLUMNS = [
+	("deal", 'I', '<u4'),
+	("moves", 'I', '<u4'),
+	("undone", 'I', '<u4'),
+	("won", 'B', '|b1'),
+]
+
+# Room reserved for the .npy header, which is only written once the number
+# of rows is known. Must be a multiple of 64.
+NPY_HEADER_SIZE = 128
+
+# rows buffered per column before they are written out
+BUFFER_ROWS = 65536
+
+FIRST_CELL = NUM_TOWERS
+FIRST_SUIT = NUM_TOWERS + NUM_CELLS
+
+
+class ColumnWriter (object):
+	'''
+	Streams values of one column into a .npy file.
+	'''
+
+	def __init__(self, path, typecode, dtype):
+		self.file = open(path, 'wb')
+		self.file.write(bytes(NPY_HEADER_SIZE))
+		self.typecode = typecode
+		self.dtype = dtype
+		self.buffer = array(typecode)
+		self.rows = 0
+
+	def append(self, value):
+		self.buffer.append(value)
+		if len(self.buffer) >= BUFFER_ROWS:
+			self.write_buffer()
+
+	def write_buffer(self):
+		if sys.byteorder == 'big':
+			self.buffer.byteswap()
+		self.file.write(self.buffer.tobytes())
+		self.rows += len(self.buffer)
+		self.buffer = array(self.typecode)
+
+	def close(self):
+		self.write_buffer()
+		header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (self.dtype, self.rows)
+		header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + "\n"
+		self.file.seek(0)
+		self.file.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1'))
+		self.file.close()
+
+
+class TableWriter (object):
+	'''
+	Streams rows into one ColumnWriter per column, named <table>_<column>.npy.
+	'''
+
+	def __init__(self, directory, table, columns):
+		self.columns = [ColumnWriter(os.path.join(directory, "%s_%s.npy" % (table, name)), typecode, dtype)
+			for (name, typecode, dtype) in columns]
+
+	def append(self, row):
+		for (column, value) in zip(self.columns, row):
+			column.append(value)
+
+	def close(self):
+		for column in self.columns:
+			column.close()
+
+
+def read_json_game(data):
+	'''
+	Returns (deal, move_history, redo_stack, won) from the contents of a JSON
+	save file.
+	'''
+	dict_repr = json.loads(data)
+	deal = dict_repr.get("deal")
+	won = sum(len(slot) for slot in dict_repr["slots"][FIRST_SUIT:]) == 52
+	return (deal, dict_repr["move_history"], dict_repr["redo_stack"], won)
+
+
+def read_packed_game(data):
+	'''
+	Returns (deal, move_history, redo_stack, won) from the contents of a packed
+	session file.
+	'''
+	(version, deal, _) = struct.unpack_from(PACKED_HEADER, data)
+	if version != PACKED_VERSION:
+		raise ValueError("unknown packed game version %d" % version)
+	offset = struct.calcsize(PACKED_HEADER)
+	lengths = data[offset:offset+18]
+	won = sum(lengths[FIRST_SUIT:]) == 52
+	offset += 18 + sum(lengths)
+	(history_length, redo_length) = struct.unpack_from(PACKED_COUNTS, data, offset)
+	offset += struct.calcsize(PACKED_COUNTS)
+	moves = []
+	for i in range(offset, offset + 3*(history_length + redo_length), 3):
+		(source, dest, count) = data[i:i+3]
+		moves.append((source, dest, count & ~AUTO_MOVE_FLAG, count & AUTO_MOVE_FLAG))
+	return (None if deal == NO_DEAL else deal, moves[:history_length], moves[history_length:], won)
+
+
+def read_game_file(path):
+	with open(path, 'rb') as game_file:
+		data = game_file.read()
+	if data[:1] in (b'{', b' ', b'\n'):
+		return read_json_game(data)
+	return read_packed_game(data)
+
+
+def export_games(paths, directory):
+	'''
+	Writes the moves and games tables for the game files at paths into
+	directory. Returns the number of games exported.
+	'''
+	os.makedirs(directory, exist_ok=True)
+	moves = TableWriter(directory, "moves", MOVE_COLUMNS)
+	games = TableWriter(directory, "games", GAME_COLUMNS)
+	game_number = 0
+	# close the writers even on error, so every file gets a valid header
+	try:
+		for path in paths:
+			(deal, history, redo_stack, won) = read_game_file(path)
+			deal = NO_DEAL if deal is None else deal
+			# The redo stack holds undone moves latest-undone last, so reversed it
+			# continues the history in the order the moves were originally played.
+			played = list(history) + list(reversed(redo_stack))
+			for (index, (source, dest, count, is_auto)) in enumerate(played):
+				moves.append((game_number, deal, index, source, dest, count, bool(is_auto), index >= len(history)))
+			games.append((deal, len(history), len(redo_stack), won))
+			game_number += 1
+	finally:
+		moves.close()
+		games.close()
+	return game_number
+
+
+def load_table(directory, table, columns):
+	'''
+	Returns a dict of column name -> memory-mapped NumPy array.
+	'''
+	import numpy
+	return {name: numpy.load(os.path.join(directory, "%s_%s.npy" % (table, name)), mmap_mode='r')
+		for (name, _, _) in columns}
+
+
+def summarize(directory):
+	'''
+	Computes summary statistics over exported tables with vectorized NumPy
+	operations. Returns a dict of results.
+	'''
+	import numpy
+	moves = load_table(directory, "moves", MOVE_COLUMNS)
+	games = load_table(directory, "games", GAME_COLUMNS)
+
+	is_auto = moves["is_auto"]
+	undone = moves["undone"]
+	dest = moves["dest"]
+	player_moves = ~is_auto
+	num_player_moves = int(numpy.count_nonzero(player_moves))
+
+	num_games = len(games["deal"])
+	to_cell = (dest >= FIRST_CELL) & (dest < FIRST_SUIT) & ~undone
+	cells_per_game = numpy.bincount(moves["game"][to_cell], minlength=num_games)
+
+	# win rate per deal
+	(deals, deal_index, games_per_deal) = numpy.unique(games["deal"], return_inverse=True, return_counts=True)
+	wins_per_deal = numpy.bincount(deal_index, weights=games["won"], minlength=len(deals))
+
+	return {
+		"games": num_games,
+		"moves": len(is_auto),
+		"player_moves": num_player_moves,
+		"auto_move_fraction": float(numpy.count_nonzero(is_auto)) / max(len(is_auto), 1),
+		"undo_rate": float(numpy.count_nonzero(undone & player_moves)) / max(num_player_moves, 1),
+		"cells_used_per_game": float(cells_per_game.mean()) if num_games else 0.0,
+		"win_rate": float(numpy.count_nonzero(games["won"])) / max(num_games, 1),
+		"win_rate_by_deal": dict(zip(deals.tolist(), (wins_per_deal / games_per_deal).tolist())),
+	}
+
+
+if __name__ == '__main__':
+	if len(sys.argv) >= 4 and sys.argv[1] == "export":
+		count = export_games(sys.argv[3:], sys.argv[2])
+		print("exported %d games to %s" % (count, sys.argv[2]))
+	elif len(sys.argv) == 3 and sys.argv[1] == "summarize":
+		summary = summarize(sys.argv[2])
+		win_rate_by_deal = summary.pop("win_rate_by_deal")
+		for (key, value) in summary.items():
+			print("%s: %s" % (key, value))
+		print("deals played: %d" % len(win_rate_by_deal))
+	else:
+		print(__doc__)
+		sys.exit(1)
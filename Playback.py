@@ -0,0 +1,85 @@
+import contextlib
+import io
+
+from Seahaven import Seahaven
+
+
+class Playback (object):
+	'''
+	Plays a list of (source, dest, count) moves, such as a Solver solution,
+	into a Seahaven game a chunk at a time.
+
+	The whole list is validated once, up front, on a copy of the game. After
+	that, moves go in through Seahaven.apply_moves(), which skips the
+	per-move validation, printing and saving of Seahaven.move(). The game is
+	saved once, when playback pauses, seeks or finishes.
+
+	position is the number of moves played so far. Whoever drives the playback
+	(TableNode, or a headless test) calls step() whenever it is ready for
+	more moves. Seeking back undoes moves, which leaves them on the game's
+	redo stack; undone counts them, so seeking forward again can redo them.
+	'''
+
+	def __init__(self, game, moves, chunk_size=4):
+		self.game = game
+		self.moves = list(moves)
+		self.chunk_size = chunk_size
+		self.position = 0
+		self.undone = 0
+		self.playing = False
+		self.validate()
+
+	def validate(self):
+		copy = Seahaven(packed=self.game.to_bytes())
+		message = io.StringIO()
+		with contextlib.redirect_stdout(message):
+			for (i, move) in enumerate(self.moves):
+				if not copy.move(*move):
+					raise ValueError("move %d %r is invalid: %s" % (i, move, message.getvalue().strip()))
+
+	def is_finished(self):
+		return self.position >= len(self.moves)
+
+	def play(self):
+		self.playing = not self.is_finished()
+
+	def pause(self):
+		if self.playing:
+			self.playing = False
+			self.game.save()
+
+	def step(self):
+		'''
+		Plays the next chunk of moves, if playing. Returns the number of moves
+		played.
+		'''
+		if not self.playing:
+			return 0
+		chunk = self.moves[self.position:self.position + self.chunk_size]
+		self.game.apply_moves(chunk)
+		self.position += len(chunk)
+		self.undone = 0
+		if self.is_finished():
+			self.playing = False
+			self.game.save()
+		return len(chunk)
+
+	def seek(self, position):
+		'''
+		Jumps to position (a number of moves from the start of the list), by
+		undoing or redoing moves, then playing any others all at once.
+		'''
+		position = max(0, min(position, len(self.moves)))
+		while self.position > position:
+			self.game.undo(save=False)
+			self.position -= 1
+			self.undone += 1
+		while self.position < position and self.undone > 0:
+			self.game.redo(save=False)
+			self.position += 1
+			self.undone -= 1
+		if self.position < position:
+			self.game.apply_moves(self.moves[self.position:position])
+			self.position = position
+			self.undone = 0
+		self.game.save()
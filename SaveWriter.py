@@ -0,0 +1,81 @@
+import json
+import os
+import threading
+
+
+def write_json_atomically(path, data):
+	'''
+	Write data to path as JSON. The data goes to a temporary file first, which
+	is then renamed over path, so path always holds either the old or the new
+	contents, never a partly written file.
+	'''
+	temp_path = path + ".tmp"
+	with open(temp_path, "w") as json_file:
+		json.dump(data, json_file)
+		json_file.flush()
+		os.fsync(json_file.fileno())
+	os.replace(temp_path, path)
+
+
+class SaveWriter (object):
+	'''
+	Writes game state snapshots to disk on a background thread, so saving never
+	blocks the caller. If several snapshots for the same file arrive before the
+	thread gets to them, only the latest one is written.
+
+	Snapshots must not be modified after they are passed to submit(). Call
+	flush() to wait until everything submitted so far is on disk.
+	'''
+
+	def __init__(self):
+		self.condition = threading.Condition()
+		self.pending = {}			# path -> latest snapshot not yet written
+		self.writing = False
+		self.closed = False
+		self.thread = threading.Thread(target=self.run, name="SaveWriter", daemon=True)
+		self.thread.start()
+
+	def submit(self, path, snapshot):
+		with self.condition:
+			if self.closed:
+				raise ValueError("SaveWriter is closed")
+			self.pending[path] = snapshot
+			self.condition.notify_all()
+
+	def flush(self):
+		'''
+		Block until every snapshot submitted so far has been written.
+		'''
+		with self.condition:
+			while self.pending or self.writing:
+				self.condition.wait()
+
+	def close(self):
+		'''
+		Write any pending snapshots, then stop the background thread.
+		'''
+		with self.condition:
+			self.closed = True
+			self.condition.notify_all()
+		self.thread.join()
+
+	def run(self):
+		while True:
+			with self.condition:
+				while not self.pending and not self.closed:
+					self.condition.wait()
+				if not self.pending:
+					return
+				batch = self.pending
+				self.pending = {}
+				self.writing = True
+
+			for (path, snapshot) in batch.items():
+				try:
+					write_json_atomically(path, snapshot)
+				except Exception as e:
+					print("Could not save game to %s: %s" % (path, e))
+
+			with self.condition:
+				self.writing = False
+				self.condition.notify_all()
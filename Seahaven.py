@@ -1,7 +1,5 @@
 import random
-import math
-import console
-import json
+import struct
 
 from itertools import product
 
@@ -12,6 +10,20 @@ NUM_CELLS = 4
 NUM_SLOTS = 4
 NUM_CARDS_PER_TOWER = 5
 
+# deals are numbered 0..NUM_DEALS-1
+NUM_DEALS = 2**31
+
+# Layout of the packed form written by Seahaven.to_bytes() (little-endian):
+#   version (uint8), deal (uint32, NO_DEAL if unknown), empty cells (uint8)
+#   18 slot lengths (uint8 each), then every card as rank*4 + suit (uint8)
+#   move_history and redo_stack lengths (uint32 each), then every move as
+#   3 bytes: source, dest, count (with bit 7 set if the move was automatic)
+PACKED_VERSION = 1
+PACKED_HEADER = '<BIB'
+PACKED_COUNTS = '<II'
+NO_DEAL = 0xFFFFFFFF
+AUTO_MOVE_FLAG = 0x80
+
 
 def is_descending_sequence_common_suit(cards):
 	'''
@@ -95,9 +107,15 @@ class Deck (object):
 		suits = Suit.all_suits
 		self.cards = [Card(r, s) for r, s in product(ranks, suits)]
 			
-	def shuffle(self):
-		'''Shuffle the deck.'''
-		random.shuffle(self.cards)
+	def shuffle(self, seed=None):
+		'''
+		Shuffle the deck. If seed is given, the shuffle is repeatable: the same
+		seed always produces the same order.
+		'''
+		if seed is None:
+			random.shuffle(self.cards)
+		else:
+			random.Random(seed).shuffle(self.cards)
 		
 	def deal(self, number):
 		'''Remove number cards off the top of the deck and return them in list.'''
@@ -108,7 +126,7 @@ class Deck (object):
 		
 class Seahaven (object):
 		
-	def __init__(self, save_file=None):
+	def __init__(self, save_file=None, deal=None, save_writer=None, packed=None):
 		self.gui = None
 		
 		# Each tower, cell and suit stack is given a slot index and represented as
@@ -125,9 +143,22 @@ class Seahaven (object):
 		self.empty_cells_count = 0
 		self.save_file = save_file
 		
+		# If save_writer (a SaveWriter) is given, saves are handed to it and
+		# written in the background instead of before save() returns.
+		self.save_writer = save_writer
+		
+		# number of the deal being played; see new_game()
+		self.deal = None
+		
 		game_loaded = False
 		
-		if save_file:
+		# packed is a bytes object from to_bytes() to restore the game from
+		if packed is not None:
+			self.from_bytes(packed)
+			game_loaded = True
+		elif save_file:
+			# json is only needed for save files, so a headless engine never imports it
+			import json
 			try:
 				with open(save_file) as json_file:
 					self.from_dict(json.load(json_file))
@@ -136,7 +167,7 @@ class Seahaven (object):
 				pass
 				
 		if not game_loaded:
-			self.new_game()
+			self.new_game(deal)
 		
 	def to_dict(self):
 		dict_repr = {}
@@ -144,9 +175,10 @@ class Seahaven (object):
 		for slot in self.slots:
 			slots.append([(c.rank, c.suit) for c in slot])
 		dict_repr["slots"] = slots
-		dict_repr["move_history"] = self.move_history
-		dict_repr["redo_stack"] = self.redo_stack
+		dict_repr["move_history"] = list(self.move_history)
+		dict_repr["redo_stack"] = list(self.redo_stack)
 		dict_repr["empty_cells_count"] = self.empty_cells_count
+		dict_repr["deal"] = self.deal
 		return dict_repr
 		
 	def from_dict(self, dict_repr):
@@ -159,15 +191,70 @@ class Seahaven (object):
 		self.move_history = dict_repr["move_history"]
 		self.redo_stack = dict_repr["redo_stack"]
 		self.empty_cells_count = dict_repr["empty_cells_count"]
+		self.deal = dict_repr.get("deal")
+		
+	def to_bytes(self):
+		'''
+		Returns the game state packed into a compact bytes object (about 80
+		bytes plus 3 per move of history), for storing many idle games.
+		'''
+		deal = NO_DEAL if self.deal is None else self.deal
+		if not 0 <= deal < NUM_DEALS and deal != NO_DEAL:
+			raise ValueError("deal %d can't be packed" % deal)
+		data = bytearray(struct.pack(PACKED_HEADER, PACKED_VERSION, deal, self.empty_cells_count))
+		data.extend(len(slot) for slot in self.slots)
+		for slot in self.slots:
+			data.extend(c.rank*4 + c.suit for c in slot)
+		data.extend(struct.pack(PACKED_COUNTS, len(self.move_history), len(self.redo_stack)))
+		for (source, dest, count, is_auto) in self.move_history + self.redo_stack:
+			data.extend((source, dest, count | AUTO_MOVE_FLAG if is_auto else count))
+		return bytes(data)
+		
+	def from_bytes(self, data):
+		(version, deal, empty_cells_count) = struct.unpack_from(PACKED_HEADER, data)
+		if version != PACKED_VERSION:
+			raise ValueError("unknown packed game version %d" % version)
+		offset = struct.calcsize(PACKED_HEADER)
+		lengths = data[offset:offset+18]
+		offset += 18
+		
+		self.slots = []
+		for length in lengths:
+			self.slots.append([Card(code >> 2, code & 3) for code in data[offset:offset+length]])
+			offset += length
+			
+		(history_length, redo_length) = struct.unpack_from(PACKED_COUNTS, data, offset)
+		offset += struct.calcsize(PACKED_COUNTS)
+		moves = []
+		for i in range(offset, offset + 3*(history_length + redo_length), 3):
+			(source, dest, count) = data[i:i+3]
+			moves.append((source, dest, count & ~AUTO_MOVE_FLAG, bool(count & AUTO_MOVE_FLAG)))
+			
+		self.move_history = moves[:history_length]
+		self.redo_stack = moves[history_length:]
+		self.empty_cells_count = empty_cells_count
+		self.deal = None if deal == NO_DEAL else deal
 		
 	def save(self):
 		if self.save_file:
-			with open(self.save_file, "w") as json_file:
-				json.dump(self.to_dict(), json_file)
+			if self.save_writer:
+				self.save_writer.submit(self.save_file, self.to_dict())
+			else:
+				from SaveWriter import write_json_atomically
+				write_json_atomically(self.save_file, self.to_dict())
 				
-	def new_game(self):
+	def new_game(self, deal=None):
+		'''
+		Deal a new game. deal is the number of the deal to play, from 0 to
+		NUM_DEALS-1; the same number always produces the same layout. If deal is
+		None, a deal is picked at random.
+		'''
+		if deal is None:
+			deal = random.randrange(NUM_DEALS)
+		self.deal = deal
+		
 		deck = Deck()
-		deck.shuffle()
+		deck.shuffle(deal)
 				
 		# deal cards into the towers
 		for i in range(NUM_TOWERS):
@@ -242,6 +329,11 @@ class Seahaven (object):
 		if source == dest:
 			print("Invalid move: source == dest")
 			return False
+		# cards that can go to a suit stack are moved there by do_auto_moves, so
+		# there is never a valid manual move to one
+		if self.is_suit_slot(dest):
+			print("Invalid move: dest is a suit stack")
+			return False
 		if count > len(self.slots[source]):
 			print("Invalid move: not enough cards in source slot")
 			return False
@@ -360,7 +452,17 @@ class Seahaven (object):
 					return i		
 		return -1
 
-	def undo(self):
+	def apply_moves(self, moves, animate=True):
+		'''
+		moves is a list of (source, dest, count) tuples that are already known to
+		be valid, such as a solution from Solver. Makes each of them, followed by
+		its auto moves. Unlike move(), nothing is validated, printed or saved.
+		'''
+		for (source, dest, count) in moves:
+			self.do_raw_move(source, dest, count, False, animate=animate, record=True, clear_redo=True)
+			self.do_auto_moves(animate=animate)
+		
+	def undo(self, save=True):
 		while len(self.move_history) > 0:
 			move = self.move_history.pop()
 			self.redo_stack.append(move)
@@ -368,9 +470,10 @@ class Seahaven (object):
 			self.do_raw_move(dest, source, count, is_auto, animate=True, record=False)
 			if not is_auto:
 				break
-		self.save()
+		if save:
+			self.save()
 		
-	def redo(self):
+	def redo(self, save=True):
 		check_for_auto = False
 		while len(self.redo_stack) > 0:
 			move = self.redo_stack.pop()
@@ -380,7 +483,8 @@ class Seahaven (object):
 				break
 			self.do_raw_move(source, dest, count, is_auto, animate=True, record=True, clear_redo=False)
 			check_for_auto = True
-		self.save()
+		if save:
+			self.save()
 		
 	def has_undo(self):
 		return len(self.move_history) > 0
@@ -395,9 +499,15 @@ class TestGUI (object):
 
 
 if __name__ == '__main__':
+	# console is Pythonista-only, and only this text UI needs it, so the model
+	# itself can be imported anywhere
+	try:
+		import console
+		console.clear()
+	except ImportError:
+		pass
 	game = Seahaven()
 	game.gui = TestGUI()
-	console.clear()
 	print(game.to_dict())
 	while True:
 		print(game)
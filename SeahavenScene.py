@@ -4,12 +4,21 @@ import random
 import math
 import ui
 import os
+import threading
+
+from collections import deque
 
 from Seahaven import *
+from SaveWriter import SaveWriter
+from DealIndex import DealIndex, DEFAULT_DIFFICULTY
+from Solver import Solver
+from Playback import Playback
 
 A = Action
 
 SAVE_FILE = "save_file.txt"
+DEAL_INDEX_FILE = "deal_index.bin"
+NO_DEAL_INDEX_WARNING = "No deal index: this deal may not be solvable"
 
 class CardNode (SpriteNode):
 	'''
@@ -91,10 +100,29 @@ class TableNode (SpriteNode):
 	NOT_DRAGGING = 1
 	DRAGGING =2
 	
+	# Animations get shorter as the queue gets deeper, so long auto-move
+	# cascades finish quickly, but never shorter than MIN_ANIMATION_DURATION.
+	ANIMATION_DURATION = 0.2
+	MIN_ANIMATION_DURATION = 0.04
+	
+	# During playback, moves are fed from the solution whenever fewer than
+	# PLAYBACK_QUEUE_DEPTH animations are waiting, PLAYBACK_CHUNK_SIZE at a time.
+	PLAYBACK_QUEUE_DEPTH = 8
+	PLAYBACK_CHUNK_SIZE = 4
+	# The solve runs on a thread in the GUI process and competes with frames
+	# and touches for the GIL, so its budget is kept to about a second.
+	PLAYBACK_MAX_NODES = 5000
+	
 	def __init__(self):
-		# Create a card node so we can get the width and height of a single
+		# Create the CardNode for every card once, up front. set_game() just
+		# repositions these, so loading a game never rebuilds sprites.
+		self.card_nodes = {}				# Card -> CardNode
+		for card in Deck().cards:
+			self.card_nodes[card] = CardNode(card)
+		
+		# Use one of the card nodes to get the width and height of a single
 		# card. The size of the table will be based on that.
-		card = CardNode(Card(Rank.ace, Suit.spades))
+		card = self.card_nodes[Card(Rank.ace, Suit.spades)]
 		self.card_size = card.size
 		(self.card_width, self.card_height) = card.size
 		
@@ -114,11 +142,19 @@ class TableNode (SpriteNode):
 		
 		super().__init__(color='#046e0d', size=(table_width, table_height))
 		
+		self.setup_layout()
 		self.setup_placards()
 		self.setup_buttons()
 		
+		# shown when a new game had to be dealt at random; see new_game()
+		self.warning_label = LabelNode('', font=('Helvetica', 24))
+		self.warning_label.position = (0, 100-self.size.height/2)
+		self.add_child(self.warning_label)
+		
 		self.game = None 						# a Seahaven object
-		self.card_nodes = {}				# Card -> CardNode
+		
+		# saves game state in the background, off the touch handling path
+		self.save_writer = SaveWriter()
 		
 		self.current_touch = None
 		
@@ -128,12 +164,63 @@ class TableNode (SpriteNode):
 		self.drag_cards = None
 		self.move_source = None 		# (slot index, num cards)
 		
-		self.current_animation = None
-		self.animation_node = None
+		# animation_queue holds (source_cards, dest_slot_index, dest_offset) tuples
+		# waiting to be played. current_animations holds (animation, node) tuples
+		# for the ones playing now; several can play at once.
+		self.animation_queue = deque()
+		self.current_animations = []
 		
 		self.pressed_button = None
 		self.selected_card = None
+		
+		# Solvable deals by difficulty, if the index has been built (see
+		# DealIndex.py). Without it, new games are dealt at random.
+		self.deal_index = None
+		if os.path.exists(DEAL_INDEX_FILE):
+			self.deal_index = DealIndex.load(DEAL_INDEX_FILE)
+		self.difficulty = DEFAULT_DIFFICULTY
+		
+		# Autoplay of a solution. The solver runs in a background thread and
+		# leaves (packed game, moves) in pending_solution for update() to pick
+		# up. playback_speed divides the animation durations while playing.
+		self.playback = None 				# a Playback object
+		self.pending_solution = None
+		self.solving = False
+		self.no_solution = False			# the solver gave up on this position
+		self.playback_speed = 1.0
 	
+	def setup_layout(self):
+		'''
+		Precompute the geometry of every slot. The table's geometry is fixed (screen
+		size changes only scale the whole table), so this only needs doing once.
+		'''
+		# position of the first card in each slot, by slot index
+		suit_columns = [1, 0, 8, 9]
+		self.slot_positions = []
+		for i in range(10):
+			self.slot_positions.append(Point(*self.card_position_at(i, 1)))
+		for i in range(4):
+			self.slot_positions.append(Point(*self.card_position_at(3+i, 0)))
+		for suit in Suit.all_suits:
+			self.slot_positions.append(Point(*self.card_position_at(suit_columns[suit], 0)))
+		
+		# Hit-test boxes for the cells, as (left, right, bottom, top) tuples.
+		self.cell_hit_boxes = []
+		for i in range(4):
+			frame = self.card_frame_at(3+i, 0)
+			self.cell_hit_boxes.append((frame.x, frame.x + frame.w, frame.y, frame.y + frame.h))
+			
+		# Hit-test columns for the towers, as (left, right, top) tuples. The top of
+		# a tower's frame doesn't depend on its height; tower_hit_bottoms[n] is the
+		# bottom of the frame of a tower with n cards.
+		self.tower_hit_columns = []
+		for i in range(10):
+			frame = self.card_frame_at(i, 1)
+			self.tower_hit_columns.append((frame.x, frame.x + frame.w, frame.y + frame.h))
+		top = self.tower_hit_columns[0][2]
+		max_height = NUM_CARDS_PER_TOWER + Rank.king
+		self.tower_hit_bottoms = [top - self.card_height - max(n, 1)*self.v_gap for n in range(max_height+1)]
+		
 	def setup_placards(self):
 		# Add suit placards
 		suits_columns = [(Suit.diamonds, 0), (Suit.clubs, 1), (Suit.hearts, 8), (Suit.spades, 9)]
@@ -165,26 +252,149 @@ class TableNode (SpriteNode):
 			(image, identifier, column, action) = button_info
 			button = ButtonNode(image, identifier, action)
 			button.position = self.card_position_at(column, 0)
+			button.hit_frame = button.frame
 			self.buttons.append(button)
 			self.add_child(button)
 			
 		new_game_button = ButtonNode('iow:ios7_flag_256', 'new_game', self.new_game)
 		new_game_button.position = (0, 40-self.size.height/2 )
+		new_game_button.hit_frame = new_game_button.frame
 		self.buttons.append(new_game_button)
 		self.add_child(new_game_button)
+		
+		self.play_button = ButtonNode('iow:ios7_play_256', 'play', self.toggle_playback)
+		self.play_button.position = (self.card_width + self.h_gap, 40-self.size.height/2)
+		self.play_button.hit_frame = self.play_button.frame
+		self.buttons.append(self.play_button)
+		self.add_child(self.play_button)
 	
 	def undo(self):
+		# while a solution is loaded, undo and redo step through it
+		if self.playback and self.playback.position > 0:
+			self.seek_playback(self.playback.position - 1, animate=True)
+			return
+		self.stop_playback()
 		self.game.undo()
 		self.process_next_animation()
 		
 	def redo(self):
+		if self.playback and self.playback.undone > 0:
+			self.seek_playback(self.playback.position + 1, animate=True)
+			return
+		if self.game.has_redo():
+			self.stop_playback()
 		self.game.redo()
 		self.process_next_animation()
 		
-	def new_game(self):
+	def new_game(self, difficulty=None):
+		'''
+		Deal a new game of difficulty (one of DealIndex.DIFFICULTIES), or of the
+		last difficulty asked for if it isn't given.
+		'''
+		if difficulty is not None:
+			self.difficulty = difficulty
+		# make sure no save of the old game lands after the file is removed
+		self.save_writer.flush()
 		if os.path.exists(SAVE_FILE):
 			os.unlink(SAVE_FILE)
-		self.set_game(Seahaven(SAVE_FILE))
+		deal = None
+		if self.deal_index:
+			deal = self.deal_index.pick(self.difficulty)
+		self.set_game(Seahaven(SAVE_FILE, deal, self.save_writer))
+		# Without a deal index (or with an empty one), the deal is random and
+		# may not be solvable, so say so.
+		if deal is None:
+			self.warning_label.text = NO_DEAL_INDEX_WARNING
+		
+	def toggle_playback(self):
+		'''
+		Play or pause the solution. The first time, solve the current position in
+		the background; playback starts once update() finds the solution.
+		'''
+		if self.playback and self.playback.playing:
+			self.pause_playback()
+		elif self.playback and not self.playback.is_finished():
+			self.playback.play()
+		elif not self.solving and not self.no_solution:
+			self.solving = True
+			packed = self.game.to_bytes()
+			thread = threading.Thread(target=self.solve_in_background, args=(packed,), daemon=True)
+			thread.start()
+		self.update_play_button()
+		
+	def solve_in_background(self, packed):
+		# always post a result, so solving never stays stuck on
+		moves = None
+		try:
+			solver = Solver.from_game(Seahaven(packed=packed), max_nodes=TableNode.PLAYBACK_MAX_NODES)
+			moves = solver.solve()
+		finally:
+			self.pending_solution = (packed, moves)
+		
+	def start_pending_playback(self):
+		(packed, moves) = self.pending_solution
+		self.pending_solution = None
+		self.solving = False
+		# drop the solution if the game changed while it was being found
+		if packed != self.game.to_bytes():
+			self.update_play_button()
+			return
+		# with no solution, the play button stays disabled until the player moves
+		self.no_solution = moves is None
+		if not moves:
+			self.update_play_button()
+			return
+		self.playback = Playback(self.game, moves, TableNode.PLAYBACK_CHUNK_SIZE)
+		self.playback.play()
+		self.update_play_button()
+		
+	def pause_playback(self):
+		if self.playback:
+			self.playback.pause()
+		self.update_play_button()
+		
+	def stop_playback(self):
+		'''
+		Forget the solution, e.g. because the player made a move of their own.
+		'''
+		self.playback = None
+		self.no_solution = False
+		self.update_play_button()
+		
+	def seek_playback(self, position, animate=False):
+		'''
+		Move to position in the solution. The cards just move to their new
+		places (or animate there, for a single step); no node is rebuilt.
+		'''
+		self.pause_playback()
+		self.playback.seek(position)
+		if animate:
+			self.process_next_animation()
+		else:
+			self.fast_forward_animations()
+		
+	def set_playback_speed(self, speed):
+		self.playback_speed = speed
+		
+	def update_play_button(self):
+		playing = bool(self.playback and self.playback.playing)
+		self.play_button.texture = Texture('iow:ios7_pause_256' if playing else 'iow:ios7_play_256')
+		self.play_button.set_enabled(playing or not (self.solving or self.no_solution))
+		
+	def update(self):
+		'''
+		Called every frame. Starts a solution that has just been found, and keeps
+		the animation queue topped up while it plays.
+		'''
+		if self.pending_solution:
+			self.start_pending_playback()
+		if self.playback and self.playback.playing and len(self.animation_queue) < TableNode.PLAYBACK_QUEUE_DEPTH:
+			idle = len(self.current_animations) == 0
+			self.playback.step()
+			if idle:
+				self.process_next_animation()
+			if not self.playback.playing:
+				self.update_play_button()
 		
 	def card_position_at(self, column, row):
 		'''
@@ -196,20 +406,9 @@ class TableNode (SpriteNode):
 		return self.rel_position(x, y)
 		
 	def card_position_at_slot(self, slot_index, dest_offset):
-		 
-		if slot_index < 10:
-			position = self.card_position_at(slot_index, 1)
-		elif slot_index < 14:
-			position = self.card_position_at(3 + slot_index - 10, 0)
-		else:
-			map = [1, 0, 8, 9]
-			position = self.card_position_at(map[slot_index - 14], 0)
-			
+		position = self.slot_positions[slot_index]
 		if dest_offset > 0:
-			dy = dest_offset * self.v_gap
-			(x, y) = position
-			position = Point(x, y - dy)
-			
+			position = Point(position.x, position.y - dest_offset * self.v_gap)
 		return position
 
 	def card_frame_at(self, column, row, num_cards=1):
@@ -237,32 +436,38 @@ class TableNode (SpriteNode):
 		return (rel_x, rel_y)
 		
 	def set_game(self, game):
-		for _, card_node in self.card_nodes.items():
-			card_node.remove_from_parent()
-		
+		'''
+		Show game on the table. The pooled CardNode objects are reused: each one
+		is just reset, repositioned and re-added in stacking order.
+		'''
 		self.game = game
-		self.card_nodes = {}
-		self.animation_queue = []
+		self.game.gui = self
+		self.playback = None
+		self.no_solution = False
+		self.warning_label.text = ''
+		
+		# Drop any animation or drag in progress; its cards are repositioned below.
+		self.animation_queue = deque()
+		for (_, node) in self.current_animations:
+			node.remove_all_actions()
+			node.remove_from_parent()
+		self.current_animations = []
+		if self.drag_cards:
+			self.drag_cards.remove_from_parent()
+		self.drag_cards = None
+		self.selected_card = None
 		
 		for i in range(10):
 			tower = self.game.slots[i]
-			d = 0
+			(x, y) = self.card_position_at(i, 1)
 			for card in tower:
-				card_node = CardNode(card)
-				(x, y) = self.card_position_at(i, 1)
-				y -= d * self.v_gap
-				card_node.position = (x, y)
-				self.card_nodes[card] = card_node
-				self.add_child(card_node)
-				d += 1
+				self.place_card_node(card, (x, y))
+				y -= self.v_gap
 				
 		for i in range(4):
 			cell_slot = self.game.slot_for_cell(i)
 			for card in cell_slot:
-				card_node = CardNode(card)
-				card_node.position = self.card_position_at(3+i, 0)
-				self.card_nodes[card] = card_node
-				self.add_child(card_node)
+				self.place_card_node(card, self.card_position_at(3+i, 0))
 				
 		suit_columns = [1, 0, 8, 9]
 				
@@ -270,36 +475,53 @@ class TableNode (SpriteNode):
 			suit_slot = self.game.slot_for_suit(suit)
 			column = suit_columns[suit]
 			for card in suit_slot:
-				card_node = CardNode(card)
-				card_node.position = self.card_position_at(column, 0)
-				self.card_nodes[card] = card_node
-				self.add_child(card_node)
+				self.place_card_node(card, self.card_position_at(column, 0))
 				
 		self.buttons[0].set_enabled(self.game.has_undo())
 		self.buttons[1].set_enabled(self.game.has_redo())
+		self.update_play_button()
+		
+	def place_card_node(self, card, position):
+		'''
+		Reset the pooled CardNode for card and put it on top of the table at
+		position.
+		'''
+		card_node = self.card_nodes[card]
+		card_node.remove_from_parent()
+		card_node.color = 'white'
+		card_node.position = position
+		self.add_child(card_node)
 				
 	def find_slot_containing_point(self, location):
 		'''
 		Returns (slot_index, num_cards) tuple if location is in a cell or tower slot.
 		Returns None if it is not. num_cards indicates the number of cards at or
 		below location in a tower. If the tower/cell is empty, then num_cards is 0.
+		
+		Uses the geometry precomputed by setup_layout() and the current tower
+		heights, so no frames are built per call.
 		'''
+		x = location.x
+		y = location.y
+		
 		for cell_index in range(4):
-			num_cards = len(self.game.slot_for_cell(cell_index))
-			if location in self.card_frame_at(3+cell_index, 0):
-				return (cell_index+10, num_cards)
+			(left, right, bottom, top) = self.cell_hit_boxes[cell_index]
+			if left <= x <= right and bottom <= y <= top:
+				return (cell_index+10, len(self.game.slot_for_cell(cell_index)))
 		
 		for tower_index in range(10):
+			(left, right, top) = self.tower_hit_columns[tower_index]
+			if not left <= x <= right:
+				continue
 			num_cards_in_tower = len(self.game.slot_for_tower(tower_index))
-			frame = self.card_frame_at(tower_index, 1, max(num_cards_in_tower, 1))
-			if location in frame:
-				if num_cards_in_tower < 2:
-					num_cards = num_cards_in_tower
-				else:
-					dy = frame.y+frame.h - location.y
-					card_index = min(int(dy//self.v_gap), num_cards_in_tower-1)
-					num_cards = num_cards_in_tower - card_index
-				return (tower_index, num_cards)
+			if not self.tower_hit_bottoms[num_cards_in_tower] <= y <= top:
+				return None
+			if num_cards_in_tower < 2:
+				num_cards = num_cards_in_tower
+			else:
+				card_index = min(int((top - y)//self.v_gap), num_cards_in_tower-1)
+				num_cards = num_cards_in_tower - card_index
+			return (tower_index, num_cards)
 				
 		return None
 	
@@ -351,9 +573,17 @@ class TableNode (SpriteNode):
 		# convert to coordinate space of TableNode
 		loc = self.point_from_scene(touch.location)
 		
+		# any touch but the play button pauses playback
+		if self.playback and self.playback.playing and not loc in self.play_button.hit_frame:
+			self.pause_playback()
+		
+		# a new touch skips any animations still playing
+		if self.current_animations or self.animation_queue:
+			self.fast_forward_animations()
+		
 		# check for button press
 		for button in self.buttons:
-			if loc in button.frame:
+			if loc in button.hit_frame:
 				button.set_pressed(True)
 				self.pressed_button = button
 				return
@@ -373,7 +603,7 @@ class TableNode (SpriteNode):
 		
 		# handle pressed button tracking
 		if self.pressed_button:
-			if not loc in self.pressed_button.frame:
+			if not loc in self.pressed_button.hit_frame:
 				self.pressed_button.set_pressed(False)
 			else:
 				self.pressed_button.set_pressed(True)
@@ -427,7 +657,7 @@ class TableNode (SpriteNode):
 		self.drag_state = TableNode.CHECK_FOR_DRAG
 		
 		if self.pressed_button:
-			if loc in self.pressed_button.frame:
+			if loc in self.pressed_button.hit_frame:
 				self.pressed_button.perform_action()
 			self.pressed_button.set_pressed(False)
 			self.pressed_button = None
@@ -445,6 +675,8 @@ class TableNode (SpriteNode):
 				(source_slot_index, num_cards) = self.move_source
 				(dest_slot_index, _) = dest_tuple
 				is_valid_move = self.game.move(source_slot_index, dest_slot_index, num_cards)
+				if is_valid_move:
+					self.stop_playback()
 			
 			delta_position = self.drag_cards.position
 			for card_node in self.drag_cards.children:
@@ -460,46 +692,91 @@ class TableNode (SpriteNode):
 		animation = (source_cards, dest_slot_index, dest_offset)
 		self.animation_queue.append(animation)
 		
-	def process_next_animation(self):
+	def next_animation_batch(self):
 		'''
-		Perform next queued animation.
+		Remove and return the list of queued animations to play next. Consecutive
+		moves to the suit stacks are independent of each other as long as they go
+		to different stacks, so up to four of them are played together. Any other
+		move is played on its own.
 		'''
-		DURATION = 0.2
-		
-		# Finish up current animation
-		if self.current_animation:
-			(source_cards, dest_slot_index, dest_offset) = self.current_animation
-			(x, y) = self.card_position_at_slot(dest_slot_index, dest_offset)
-			for card in source_cards:
-				card_node = self.card_nodes[card]
-				card_node.remove_from_parent()
-				card_node.position = (x, y)
-				self.add_child(card_node)
-				y -= self.v_gap
-			self.animation_node.remove_from_parent()
-			self.current_animation = None
-			self.animation_node = None
-		
-		if len(self.animation_queue) > 0:
-			self.current_animation = self.animation_queue[0]
-			del self.animation_queue[0]
-			(source_cards, dest_slot_index, dest_offset) = self.current_animation
-			self.animation_node = Node()
+		batch = [self.animation_queue.popleft()]
+		if self.game.is_suit_slot(batch[0][1]):
+			dest_slot_indexes = [batch[0][1]]
+			while self.animation_queue:
+				dest_slot_index = self.animation_queue[0][1]
+				if not self.game.is_suit_slot(dest_slot_index) or dest_slot_index in dest_slot_indexes:
+					break
+				dest_slot_indexes.append(dest_slot_index)
+				batch.append(self.animation_queue.popleft())
+		return batch
+		
+	def animation_duration(self):
+		depth = len(self.animation_queue)
+		duration = TableNode.ANIMATION_DURATION * 4 / (4 + depth)
+		duration = max(duration, TableNode.MIN_ANIMATION_DURATION)
+		if self.playback and self.playback.playing:
+			duration /= self.playback_speed
+		return duration
+		
+	def place_animated_cards(self, animation):
+		'''
+		Put the cards of animation where the animation would leave them.
+		'''
+		(source_cards, dest_slot_index, dest_offset) = animation
+		(x, y) = self.card_position_at_slot(dest_slot_index, dest_offset)
+		for card in source_cards:
+			self.place_card_node(card, (x, y))
+			y -= self.v_gap
+			
+	def finish_current_animations(self):
+		for (animation, node) in self.current_animations:
+			node.remove_all_actions()
+			self.place_animated_cards(animation)
+			node.remove_from_parent()
+		self.current_animations = []
+		
+	def start_next_animations(self):
+		if len(self.animation_queue) == 0:
+			return
+		duration = self.animation_duration()
+		batch = self.next_animation_batch()
+		for animation in batch:
+			(source_cards, dest_slot_index, dest_offset) = animation
+			node = Node()
 			for card in source_cards:
 				card_node = self.card_nodes[card]
 				card_node.remove_from_parent()
-				self.animation_node.add_child(card_node)
-			self.add_child(self.animation_node)
+				node.add_child(card_node)
+			self.add_child(node)
 			first_card = self.card_nodes[source_cards[0]]
 			dest_position = self.card_position_at_slot(dest_slot_index, dest_offset)
 			delta_position = dest_position - first_card.position
-			move_action = A.move_by(delta_position.x, delta_position.y, DURATION)
-			call_action = A.call(self.process_next_animation)
-			action_sequence = A.sequence(move_action, call_action)
-			self.animation_node.run_action(action_sequence)
+			action = A.move_by(delta_position.x, delta_position.y, duration)
+			# every animation in the batch has the same duration, so the first one
+			# alone moves the pipeline on when it is done
+			if len(self.current_animations) == 0:
+				action = A.sequence(action, A.call(self.process_next_animation))
+			node.run_action(action)
+			self.current_animations.append((animation, node))
 			
+	def process_next_animation(self):
+		'''
+		Finish the animations playing now, if any, and start the next batch.
+		'''
+		self.finish_current_animations()
+		self.start_next_animations()
+		self.buttons[0].set_enabled(self.game.has_undo())
+		self.buttons[1].set_enabled(self.game.has_redo())
+		
+	def fast_forward_animations(self):
+		'''
+		Jump straight to the end of every playing and queued animation.
+		'''
+		self.finish_current_animations()
+		while self.animation_queue:
+			self.place_animated_cards(self.animation_queue.popleft())
 		self.buttons[0].set_enabled(self.game.has_undo())
-		self.buttons[1].set_enabled(self.game.has_redo())		
+		self.buttons[1].set_enabled(self.game.has_redo())
 		
 		
 class SeahavenScene (Scene):
@@ -512,8 +789,7 @@ class SeahavenScene (Scene):
 	
 	def setup(self):
 		self.table = TableNode()
-		self.table.set_game(Seahaven(SAVE_FILE))
-		self.table.game.gui = self.table
+		self.table.set_game(Seahaven(SAVE_FILE, save_writer=self.table.save_writer))
 		
 		self.add_child(self.table)
 		self.did_change_size()
@@ -525,20 +801,30 @@ class SeahavenScene (Scene):
 		min_scale = min(x_scale, y_scale)
 		self.table.x_scale = min_scale
 		self.table.y_scale = min_scale
+		self.table_frame = self.table.frame
 	
 	def update(self):
-		pass
+		self.table.update()
+		
+	def pause(self):
+		# playback only saves when it pauses, so pause it before flushing
+		self.table.pause_playback()
+		self.table.save_writer.flush()
+		
+	def stop(self):
+		self.table.pause_playback()
+		self.table.save_writer.close()
 	
 	def touch_began(self, touch):
-		if touch.location in self.table.frame:
+		if touch.location in self.table_frame:
 			self.table.touch_began(touch)
 	
 	def touch_moved(self, touch):
-		if touch.location in self.table.frame:
+		if touch.location in self.table_frame:
 			self.table.touch_moved(touch)
 			
 	def touch_ended(self, touch):
-		if touch.location in self.table.frame:
+		if touch.location in self.table_frame:
 			self.table.touch_ended(touch)
 			
 			
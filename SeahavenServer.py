@@ -0,0 +1,342 @@
+'''
+Asyncio game server: many concurrent Seahaven sessions behind one local socket.
+
+Clients send one JSON object per line and get one JSON object per line back:
+
+	{"id": 1, "session": "alice", "cmd": "new_game", "deal": 42}
+	{"id": 1, "ok": true, "state": {...}}
+
+Commands are new_game (optional "deal"), move ("source", "dest", "count"),
+undo, redo, hint and state. Every reply echoes the request's "id". Failed
+requests get "ok": false and an "error" message.
+
+	python SeahavenServer.py [--socket PATH | --port N] [--data-dir DIR]
+'''
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import re
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from Seahaven import Seahaven, NUM_DEALS
+from Solver import find_hint
+from EndgameTable import EndgameTable
+
+
+DEFAULT_SOCKET = "seahaven.sock"
+DEFAULT_DATA_DIR = "sessions"
+
+# positions the solver may search to answer one hint request
+HINT_MAX_NODES = 20000
+
+# Hints are CPU-bound pure Python, so they run in worker processes, where they
+# don't compete with the event loop for the GIL. The workers also run at a
+# lower priority, so other sessions' requests come first on a busy machine.
+DEFAULT_HINT_WORKERS = max(1, (os.cpu_count() or 1) - 1)
+HINT_WORKER_NICENESS = 10
+
+# session ids double as file names, so keep them simple
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class SessionStore (object):
+	'''
+	Holds the games of all sessions in three tiers:
+
+	- active: up to max_active recently used sessions as Seahaven objects
+	- packed: up to max_packed idle sessions as Seahaven.to_bytes() data
+	- disk: everything else, one file per session in directory
+
+	Sessions move down a tier when the tier above overflows, least recently
+	used first, and back up to active when used. Changed sessions reach disk
+	in batches: take_dirty() collects them and write_batch() writes them.
+	'''
+
+	def __init__(self, directory, max_active=1000, max_packed=100000):
+		self.directory = directory
+		self.max_active = max_active
+		self.max_packed = max_packed
+		self.active = OrderedDict()		# session id -> Seahaven, least recently used first
+		self.packed = OrderedDict()		# session id -> bytes, least recently used first
+		self.dirty = set()				# session ids changed since the last take_dirty()
+		self.unwritten = {}				# session id -> bytes evicted while dirty
+		self.in_flight = {}				# session id -> bytes being written by write_batch()
+		os.makedirs(directory, exist_ok=True)
+
+	def __len__(self):
+		return len(self.active) + len(self.packed)
+
+	def path_for_session(self, session_id):
+		return os.path.join(self.directory, session_id + ".bin")
+
+	def get(self, session_id):
+		'''
+		Returns the Seahaven for session_id, or None if there is no such session.
+		'''
+		game = self.active.get(session_id)
+		if game is not None:
+			self.active.move_to_end(session_id)
+			return game
+
+		data = self.packed.pop(session_id, None)
+		if data is None:
+			data = self.unwritten.get(session_id)
+		if data is None:
+			data = self.in_flight.get(session_id)
+		if data is None:
+			try:
+				with open(self.path_for_session(session_id), "rb") as session_file:
+					data = session_file.read()
+			except FileNotFoundError:
+				return None
+
+		game = Seahaven(packed=data)
+		self.put(session_id, game)
+		return game
+
+	def put(self, session_id, game):
+		self.active[session_id] = game
+		self.active.move_to_end(session_id)
+		self.evict()
+
+	def mark_dirty(self, session_id):
+		self.dirty.add(session_id)
+
+	def evict(self):
+		# A game that can't be packed stays active, over the limit, rather than
+		# being lost; it's tried again on the next eviction.
+		for session_id in list(self.active):
+			if len(self.active) <= self.max_active:
+				break
+			try:
+				data = self.active[session_id].to_bytes()
+			except ValueError as e:
+				print("can't pack session %s: %s" % (session_id, e))
+				continue
+			del self.active[session_id]
+			self.packed[session_id] = data
+		while len(self.packed) > self.max_packed:
+			(session_id, data) = self.packed.popitem(last=False)
+			if session_id in self.dirty:
+				self.unwritten[session_id] = data
+
+	def take_dirty(self):
+		'''
+		Returns a dict of session id -> packed data for every session changed
+		since the last call, and marks them clean. A session that can't be packed
+		stays dirty.
+		'''
+		batch = {}
+		still_dirty = set()
+		for session_id in self.dirty:
+			game = self.active.get(session_id)
+			if game is not None:
+				try:
+					batch[session_id] = game.to_bytes()
+				except ValueError as e:
+					print("can't pack session %s: %s" % (session_id, e))
+					still_dirty.add(session_id)
+			elif session_id in self.packed:
+				batch[session_id] = self.packed[session_id]
+			elif session_id in self.unwritten:
+				batch[session_id] = self.unwritten[session_id]
+		self.dirty = still_dirty
+		self.in_flight.update(batch)
+		return batch
+
+	def write_batch(self, batch):
+		'''
+		Writes a batch from take_dirty() to disk. Safe to call from another
+		thread.
+		'''
+		for (session_id, data) in batch.items():
+			path = self.path_for_session(session_id)
+			temp_path = path + ".tmp"
+			with open(temp_path, "wb") as session_file:
+				session_file.write(data)
+			os.replace(temp_path, path)
+
+	def written(self, batch):
+		'''
+		Forget the in-memory copies of evicted sessions whose data in batch is
+		now on disk.
+		'''
+		for (session_id, data) in batch.items():
+			if self.in_flight.get(session_id) is data:
+				del self.in_flight[session_id]
+			if session_id not in self.dirty:
+				self.unwritten.pop(session_id, None)
+
+
+def state_for_client(game):
+	state = game.to_dict()
+	del state["move_history"]
+	del state["redo_stack"]
+	state["has_undo"] = game.has_undo()
+	state["has_redo"] = game.has_redo()
+	state["won"] = sum(len(game.slot_for_suit(suit)) for suit in range(4)) == 52
+	return state
+
+
+# the EndgameTable of a hint worker process, opened once by init_hint_worker()
+hint_endgame = None
+
+
+def init_hint_worker(endgame_path):
+	global hint_endgame
+	if hasattr(os, "nice"):
+		os.nice(HINT_WORKER_NICENESS)
+	hint_endgame = EndgameTable(endgame_path) if endgame_path else None
+
+
+def hint_for_packed(packed, max_nodes):
+	'''
+	Runs in a hint worker: returns find_hint() for the game packed by
+	Seahaven.to_bytes().
+	'''
+	return find_hint(Seahaven(packed=packed), max_nodes, None, hint_endgame)
+
+
+class SeahavenServer (object):
+
+	def __init__(self, store, flush_interval=1.0, endgame_path=None, hint_workers=DEFAULT_HINT_WORKERS):
+		self.store = store
+		self.flush_interval = flush_interval
+		self.flush_task = None
+		# endgame_path is an endgame table file for hints to use, or None
+		self.hint_pool = ProcessPoolExecutor(hint_workers, initializer=init_hint_worker, initargs=(endgame_path,))
+		# at most one hint per worker in flight; the rest wait their turn here
+		self.hint_slots = asyncio.Semaphore(hint_workers)
+
+	async def handle_request(self, request):
+		session_id = request.get("session")
+		if not isinstance(session_id, str) or not SESSION_ID_PATTERN.match(session_id):
+			raise ValueError("invalid session id")
+		cmd = request.get("cmd")
+
+		if cmd == "new_game":
+			deal = request.get("deal")
+			if deal is not None:
+				deal = int(deal)
+				if not 0 <= deal < NUM_DEALS:
+					raise ValueError("deal must be from 0 to %d" % (NUM_DEALS - 1))
+			game = Seahaven(deal=deal)
+			self.store.put(session_id, game)
+			self.store.mark_dirty(session_id)
+			return {"state": state_for_client(game)}
+
+		game = self.store.get(session_id)
+		if game is None:
+			raise ValueError("no such session: %s" % session_id)
+
+		if cmd == "state":
+			return {"state": state_for_client(game)}
+
+		if cmd == "hint":
+			# The worker gets its own packed copy of the game, so the session can
+			# keep changing while the hint is worked out.
+			packed = game.to_bytes()
+			loop = asyncio.get_running_loop()
+			async with self.hint_slots:
+				move = await loop.run_in_executor(self.hint_pool, hint_for_packed, packed, HINT_MAX_NODES)
+			return {"hint": move}
+
+		if cmd == "move":
+			# Seahaven.move() prints why a move is invalid; pass that on instead.
+			message = io.StringIO()
+			with contextlib.redirect_stdout(message):
+				valid = game.move(int(request["source"]), int(request["dest"]), int(request["count"]))
+			if not valid:
+				raise ValueError(message.getvalue().strip())
+		elif cmd == "undo":
+			game.undo()
+		elif cmd == "redo":
+			game.redo()
+		else:
+			raise ValueError("unknown command: %s" % cmd)
+
+		self.store.mark_dirty(session_id)
+		return {"state": state_for_client(game)}
+
+	async def handle_connection(self, reader, writer):
+		try:
+			while True:
+				try:
+					line = await reader.readline()
+				except ValueError:
+					# The line is longer than the reader's limit. The rest of it
+					# can't be skipped reliably, so give up on the connection.
+					writer.write(json.dumps({"ok": False, "error": "request too long"}).encode() + b"\n")
+					await writer.drain()
+					break
+				if not line:
+					break
+				request = {}
+				try:
+					request = json.loads(line)
+					reply = await self.handle_request(request)
+					reply["ok"] = True
+				except Exception as e:
+					reply = {"ok": False, "error": str(e)}
+				if isinstance(request, dict) and "id" in request:
+					reply["id"] = request["id"]
+				writer.write(json.dumps(reply).encode() + b"\n")
+				await writer.drain()
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
+
+	async def flush(self):
+		batch = self.store.take_dirty()
+		if batch:
+			loop = asyncio.get_running_loop()
+			await loop.run_in_executor(None, self.store.write_batch, batch)
+			self.store.written(batch)
+
+	async def flush_periodically(self):
+		while True:
+			await asyncio.sleep(self.flush_interval)
+			await self.flush()
+
+	async def serve(self, socket_path=None, port=None):
+		if port is not None:
+			server = await asyncio.start_server(self.handle_connection, "127.0.0.1", port)
+		else:
+			if os.path.exists(socket_path):
+				os.unlink(socket_path)
+			server = await asyncio.start_unix_server(self.handle_connection, socket_path)
+		self.flush_task = asyncio.ensure_future(self.flush_periodically())
+		try:
+			async with server:
+				await server.serve_forever()
+		finally:
+			self.flush_task.cancel()
+			await self.flush()
+			self.hint_pool.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Serve Seahaven games over a local socket.")
+	parser.add_argument("--socket", default=DEFAULT_SOCKET, help="unix socket path to listen on")
+	parser.add_argument("--port", type=int, default=None, help="listen on this localhost TCP port instead")
+	parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="directory for evicted sessions")
+	parser.add_argument("--max-active", type=int, default=1000, help="sessions kept unpacked in memory")
+	parser.add_argument("--max-packed", type=int, default=100000, help="sessions kept packed in memory")
+	parser.add_argument("--flush-interval", type=float, default=1.0, help="seconds between batched writes")
+	parser.add_argument("--endgame", default=None, help="endgame table file to answer hints from")
+	parser.add_argument("--hint-workers", type=int, default=DEFAULT_HINT_WORKERS, help="processes working out hints")
+	args = parser.parse_args()
+
+	store = SessionStore(args.data_dir, args.max_active, args.max_packed)
+	server = SeahavenServer(store, args.flush_interval, args.endgame, args.hint_workers)
+	try:
+		asyncio.run(server.serve(args.socket, args.port))
+	except KeyboardInterrupt:
+		pass
@@ -0,0 +1,322 @@
+from Seahaven import NUM_TOWERS, NUM_CELLS, Rank
+from TranspositionTable import TranspositionTable, key_from_bytes
+
+
+# Cards are encoded as small integers (rank*4 + suit) so that a whole slot
+# fits in a bytes object. Foundation slots keep their cards too, mirroring
+# Seahaven.slots exactly, so solver moves use the same slot indices as
+# Seahaven.move().
+NUM_SLOTS_TOTAL = NUM_TOWERS + NUM_CELLS + 4
+FIRST_CELL = NUM_TOWERS
+FIRST_SUIT = NUM_TOWERS + NUM_CELLS
+ALL_CARDS_COUNT = 52
+
+# size of the transposition table a Solver makes for itself if not given one
+DEFAULT_TABLE_BYTES = 4*1024*1024
+
+
+def encode_card(card):
+	return card.rank*4 + card.suit
+
+
+def code_rank(code):
+	return code >> 2
+
+
+def code_suit(code):
+	return code & 3
+
+
+class Solver (object):
+	'''
+	Depth-first solver for Seahaven Towers. Candidate moves are ordered by a
+	heuristic, and positions already visited are remembered in a fixed-size
+	TranspositionTable so memory stays bounded however hard the deal is.
+
+	slots must be a list of 18 lists of Card objects, as in Seahaven.slots.
+	If table isn't given, solve() makes one of DEFAULT_TABLE_BYTES. If
+	endgame (an EndgameTable) is given, the search stops as soon as it
+	reaches a position the table covers and finishes with the table's moves.
+	'''
+
+	def __init__(self, slots, max_nodes=200000, table=None, endgame=None):
+		self.slots = [[encode_card(c) for c in slot] for slot in slots]
+		self.max_nodes = max_nodes
+		self.table = table
+		self.endgame = endgame
+		self.nodes = 0
+		self.solution = None
+
+	@classmethod
+	def from_game(cls, game, **kwargs):
+		return cls(game.slots, **kwargs)
+
+	def position_key(self):
+		slots = self.slots
+		towers = sorted(bytes(slots[i]) for i in range(NUM_TOWERS))
+		cells = sorted(slots[i][0] for i in range(FIRST_CELL, FIRST_SUIT) if slots[i])
+		suits = [len(slots[i]) for i in range(FIRST_SUIT, NUM_SLOTS_TOTAL)]
+		return key_from_bytes(b'|'.join(towers) + b'#' + bytes(cells) + b'#' + bytes(suits))
+
+	def is_won(self):
+		return sum(len(self.slots[i]) for i in range(FIRST_SUIT, NUM_SLOTS_TOTAL)) == ALL_CARDS_COUNT
+
+	def empty_cells_count(self):
+		return sum(1 for i in range(FIRST_CELL, FIRST_SUIT) if not self.slots[i])
+
+	def raw_move(self, source, dest, count):
+		slots = self.slots
+		slots[dest].extend(slots[source][-count:])
+		del slots[source][-count:]
+
+	def apply_auto_moves(self, done):
+		'''
+		Moves every card that can go to its suit stack, as Seahaven.do_auto_moves
+		does, appending each (source, dest, 1) move made to done.
+		'''
+		slots = self.slots
+		made_move = True
+		while made_move:
+			made_move = False
+			for suit in range(4):
+				dest = FIRST_SUIT + suit
+				target = (len(slots[dest]) + 1)*4 + suit
+				for source in range(FIRST_SUIT):
+					if slots[source] and slots[source][-1] == target:
+						self.raw_move(source, dest, 1)
+						done.append((source, dest, 1))
+						made_move = True
+						break
+
+	def apply(self, move):
+		'''
+		Makes move and any auto moves that follow it. Returns the list of raw
+		moves made, which can be passed to revert().
+		'''
+		(source, dest, count) = move
+		self.raw_move(source, dest, count)
+		done = [move]
+		self.apply_auto_moves(done)
+		return done
+
+	def revert(self, done):
+		for (source, dest, count) in reversed(done):
+			self.raw_move(dest, source, count)
+
+	def legal_moves(self):
+		'''
+		Returns the list of (source, dest, count) moves worth trying from the
+		current position. Moves to suit stacks are left out since those happen
+		automatically, and only one of several equivalent empty towers or cells
+		is offered as a destination.
+		'''
+		slots = self.slots
+		empty_cells = self.empty_cells_count()
+		empty_tower = -1
+		for i in range(NUM_TOWERS):
+			if not slots[i]:
+				empty_tower = i
+				break
+		empty_cell = -1
+		for i in range(FIRST_CELL, FIRST_SUIT):
+			if not slots[i]:
+				empty_cell = i
+				break
+
+		# map from the card each non-empty tower will accept -> tower index
+		wanted = {}
+		for i in range(NUM_TOWERS):
+			tower = slots[i]
+			if tower and code_rank(tower[-1]) > Rank.ace:
+				wanted[tower[-1] - 4] = i
+
+		moves = []
+		for source in range(NUM_TOWERS):
+			tower = slots[source]
+			if not tower:
+				continue
+			# length of the same-suit descending run at the top of the tower
+			run = 1
+			while run < len(tower) and tower[-run-1] == tower[-run] + 4:
+				run += 1
+			run = min(run, empty_cells + 1)
+			for depth in range(1, run + 1):
+				card = tower[-depth]
+				dest = wanted.get(card)
+				if dest is not None:
+					moves.append((source, dest, depth))
+				elif code_rank(card) == Rank.king and empty_tower >= 0 and depth < len(tower):
+					moves.append((source, empty_tower, depth))
+			if empty_cell >= 0:
+				moves.append((source, empty_cell, 1))
+
+		for source in range(FIRST_CELL, FIRST_SUIT):
+			if not slots[source]:
+				continue
+			card = slots[source][0]
+			dest = wanted.get(card)
+			if dest is not None:
+				moves.append((source, dest, 1))
+			elif code_rank(card) == Rank.king and empty_tower >= 0:
+				moves.append((source, empty_tower, 1))
+
+		return moves
+
+	def score(self):
+		'''
+		Heuristic value of the current position; higher is better. Rewards
+		cards on the suit stacks and empty cells, and penalizes cards that sit
+		above a lower card of their own suit (they must move before it can).
+		'''
+		slots = self.slots
+		foundation = sum(len(slots[i]) for i in range(FIRST_SUIT, NUM_SLOTS_TOTAL))
+		blocked = 0
+		for i in range(NUM_TOWERS):
+			lowest = [99, 99, 99, 99]
+			for code in slots[i]:
+				suit = code & 3
+				if code > lowest[suit]:
+					blocked += 1
+				else:
+					lowest[suit] = code
+		return foundation*10 + self.empty_cells_count()*4 - blocked*3
+
+	def ordered_moves(self):
+		scored = []
+		for move in self.legal_moves():
+			done = self.apply(move)
+			scored.append((self.score(), move))
+			self.revert(done)
+		scored.sort(key=lambda s: s[0], reverse=True)
+		return [move for (_, move) in scored]
+
+	def expand(self, depth):
+		'''
+		Marks the current position as visited and returns the moves to try from
+		it, best last. Returns None if the position was visited before.
+		'''
+		key = self.position_key()
+		if key in self.table:
+			return None
+		self.table.store(key, depth, weight=depth)
+		self.nodes += 1
+		moves = self.ordered_moves()
+		moves.reverse()
+		return moves
+
+	def solve(self):
+		'''
+		Searches for a solution from the current position. Returns the list of
+		(source, dest, count) moves, suitable for Seahaven.move(), or None if no
+		solution was found within max_nodes positions. The position is left
+		unchanged.
+		'''
+		self.nodes = 0
+		self.solution = None
+		if self.is_won():
+			self.solution = []
+			return self.solution
+		if self.endgame:
+			distance = self.endgame.probe(self)
+			if distance is not None:
+				if distance >= 0:
+					self.solution = self.endgame_line(distance)
+				return self.solution
+
+		if self.table is None:
+			self.table = TranspositionTable(DEFAULT_TABLE_BYTES)
+		else:
+			self.table.clear()
+
+		# The search is iterative rather than recursive since solutions can be
+		# deeper than Python's recursion limit. stack holds the moves still to
+		# try at each depth; path and history hold the moves made to get here.
+		path = []
+		history = []
+		first_moves = self.expand(0)
+		stack = [first_moves] if first_moves is not None else []
+		while stack and self.nodes < self.max_nodes:
+			moves = stack[-1]
+			if not moves:
+				stack.pop()
+				if history:
+					self.revert(history.pop())
+					path.pop()
+				continue
+			move = moves.pop()
+			history.append(self.apply(move))
+			path.append(move)
+			if self.is_won():
+				self.solution = list(path)
+				break
+			if self.endgame:
+				distance = self.endgame.probe(self)
+				if distance is not None:
+					if distance >= 0:
+						self.solution = path + self.endgame_line(distance)
+						break
+					# a lost position: no need to search it
+					self.revert(history.pop())
+					path.pop()
+					continue
+			next_moves = self.expand(len(path))
+			if next_moves is None:
+				self.revert(history.pop())
+				path.pop()
+			else:
+				stack.append(next_moves)
+
+		for done in reversed(history):
+			self.revert(done)
+		return self.solution
+
+	def endgame_line(self, distance):
+		'''
+		Returns the shortest list of moves that wins from the current position,
+		which must be in self.endgame with the given distance. The position is
+		left unchanged.
+		'''
+		moves = []
+		history = []
+		while distance > 0:
+			for move in self.legal_moves():
+				done = self.apply(move)
+				if self.endgame.probe(self) == distance - 1:
+					moves.append(move)
+					history.append(done)
+					distance -= 1
+					break
+				self.revert(done)
+			else:
+				raise ValueError("endgame table is inconsistent with this position")
+		for done in reversed(history):
+			self.revert(done)
+		return moves
+
+	def cell_pressure(self, moves):
+		'''
+		Replays moves from the current position and returns the average number
+		of occupied free cells after each move. The position is left unchanged.
+		'''
+		if not moves:
+			return 0.0
+		history = []
+		total = 0
+		for move in moves:
+			history.append(self.apply(move))
+			total += NUM_CELLS - self.empty_cells_count()
+		for done in reversed(history):
+			self.revert(done)
+		return total / len(moves)
+
+
+def find_hint(game, max_nodes=20000, table=None, endgame=None):
+	'''
+	Returns the first (source, dest, count) move of a solution from the current
+	position of game (a Seahaven), or None if no solution was found. Near the
+	end of a game, endgame (an EndgameTable) answers without a search.
+	'''
+	solution = Solver.from_game(game, max_nodes=max_nodes, table=table, endgame=endgame).solve()
+	if solution:
+		return solution[0]
+	return None
@@ -0,0 +1,214 @@
+import hashlib
+
+from array import array
+
+
+# Each table entry is stored across three parallel arrays:
+#   keys:    unsigned 64-bit position hash (0 means "empty")
+#   weights: unsigned 16-bit replacement weight (search depth or cost)
+#   values:  signed 32-bit payload (e.g. distance to win, or -1 for "no win")
+KEY_BYTES = 8
+WEIGHT_BYTES = 2
+VALUE_BYTES = 4
+ENTRY_BYTES = KEY_BYTES + WEIGHT_BYTES + VALUE_BYTES
+
+# Entries are grouped into small buckets. A key can only live in the bucket
+# its hash selects, so a probe never looks at more than BUCKET_WAYS entries.
+BUCKET_WAYS = 4
+BUCKET_BYTES = ENTRY_BYTES * BUCKET_WAYS
+
+MAX_WEIGHT = 0xFFFF
+KEY_MASK = 0xFFFFFFFFFFFFFFFF
+
+
+def key_from_bytes(data):
+	'''
+	Returns a non-zero 64-bit integer hash of the bytes object data. Zero is
+	reserved to mark empty table entries.
+	'''
+	key = int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+	return key or 1
+
+
+def table_key(key):
+	'''
+	Returns key as the table stores it: cut to 64 bits, with zero (which marks
+	empty entries) mapped to 1, as key_from_bytes() does.
+	'''
+	key &= KEY_MASK
+	return key or 1
+
+
+class BloomFilter (object):
+	'''
+	Fixed-size Bloom filter over 64-bit keys. might_contain() never returns
+	False for a key that was added, so a False answer means "definitely unseen".
+	'''
+
+	def __init__(self, num_bits, num_hashes=3):
+		# round up to a whole number of bytes
+		self.num_bits = max(8, (num_bits + 7) // 8 * 8)
+		self.num_hashes = num_hashes
+		self.bits = bytearray(self.num_bits // 8)
+
+	def bit_indexes(self, key):
+		# Derive num_hashes bit positions from the two halves of the key
+		# (Kirsch-Mitzenmacher double hashing).
+		h1 = key & 0xFFFFFFFF
+		h2 = (key >> 32) | 1
+		return [(h1 + i*h2) % self.num_bits for i in range(self.num_hashes)]
+
+	def add(self, key):
+		for bit in self.bit_indexes(key):
+			self.bits[bit >> 3] |= 1 << (bit & 7)
+
+	def might_contain(self, key):
+		for bit in self.bit_indexes(key):
+			if not self.bits[bit >> 3] & (1 << (bit & 7)):
+				return False
+		return True
+
+	def clear(self):
+		self.bits = bytearray(len(self.bits))
+
+	def size_in_bytes(self):
+		return len(self.bits)
+
+
+class TranspositionTable (object):
+	'''
+	Fixed-capacity table of game-state hashes for the solver. All storage is
+	allocated up front from max_bytes, so memory use stays flat however long a
+	search runs. When a bucket is full, the entry with the lowest weight (the
+	shallowest or cheapest one) is evicted to make room.
+
+	If bloom_fraction is non-zero, that fraction of max_bytes (less, if that
+	wouldn't leave room for a bucket) is given to a BloomFilter that lets
+	lookups of never-stored keys skip the table probe. A Bloom filter can't
+	forget evicted keys, so it is rebuilt from the keys still in the table
+	once capacity entries have been evicted since the last rebuild.
+	'''
+
+	def __init__(self, max_bytes=16*1024*1024, bloom_fraction=0.0):
+		if max_bytes < BUCKET_BYTES:
+			raise ValueError("max_bytes must be at least %d" % BUCKET_BYTES)
+		bloom_bytes = min(int(max_bytes * bloom_fraction), max_bytes - BUCKET_BYTES)
+		if bloom_bytes > 0:
+			self.bloom = BloomFilter(bloom_bytes * 8)
+			bloom_bytes = self.bloom.size_in_bytes()
+		else:
+			self.bloom = None
+
+		num_buckets = (max_bytes - bloom_bytes) // BUCKET_BYTES
+		self.num_buckets = num_buckets
+		self.capacity = num_buckets * BUCKET_WAYS
+
+		self.keys = array('Q', bytes(KEY_BYTES * self.capacity))
+		self.weights = array('H', bytes(WEIGHT_BYTES * self.capacity))
+		self.values = array('i', bytes(VALUE_BYTES * self.capacity))
+
+		self.count = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.evictions_since_rebuild = 0
+
+	def __len__(self):
+		return self.count
+
+	def __contains__(self, key):
+		return self.find_entry(key) >= 0
+
+	def size_in_bytes(self):
+		bloom_bytes = self.bloom.size_in_bytes() if self.bloom else 0
+		return self.capacity * ENTRY_BYTES + bloom_bytes
+
+	def find_entry(self, key):
+		'''
+		Returns the index of the entry holding key, or -1 if it isn't stored.
+		'''
+		key = table_key(key)
+		if self.bloom and not self.bloom.might_contain(key):
+			return -1
+		keys = self.keys
+		start = (key % self.num_buckets) * BUCKET_WAYS
+		for i in range(start, start + BUCKET_WAYS):
+			if keys[i] == key:
+				return i
+		return -1
+
+	def get(self, key, default=None):
+		'''
+		Returns (weight, value) stored for key, or default if key isn't stored.
+		'''
+		i = self.find_entry(key)
+		if i < 0:
+			self.misses += 1
+			return default
+		self.hits += 1
+		return (self.weights[i], self.values[i])
+
+	def store(self, key, value=0, weight=0):
+		'''
+		Stores value for key. weight is the search depth or cost that produced
+		value: higher weights are kept in preference to lower ones when the
+		table is full. Storing a key that is already present keeps whichever
+		of the two entries has the higher weight.
+		'''
+		key = table_key(key)
+		weight = min(max(weight, 0), MAX_WEIGHT)
+		keys = self.keys
+		weights = self.weights
+		start = (key % self.num_buckets) * BUCKET_WAYS
+
+		victim = -1
+		for i in range(start, start + BUCKET_WAYS):
+			stored_key = keys[i]
+			if stored_key == key:
+				if weight >= weights[i]:
+					weights[i] = weight
+					self.values[i] = value
+				return
+			if stored_key == 0:
+				if victim < 0 or keys[victim] != 0:
+					victim = i
+			elif victim < 0 or (keys[victim] != 0 and weights[i] < weights[victim]):
+				victim = i
+
+		if keys[victim] == 0:
+			self.count += 1
+		else:
+			self.evictions += 1
+			self.evictions_since_rebuild += 1
+
+		keys[victim] = key
+		weights[victim] = weight
+		self.values[victim] = value
+		if self.bloom:
+			if self.evictions_since_rebuild > self.capacity:
+				self.rebuild_bloom()
+			else:
+				self.bloom.add(key)
+
+	def rebuild_bloom(self):
+		'''
+		Refill the Bloom filter with just the keys in the table, dropping the
+		evicted ones that would otherwise fill it up.
+		'''
+		self.bloom.clear()
+		for key in self.keys:
+			if key != 0:
+				self.bloom.add(key)
+		self.evictions_since_rebuild = 0
+
+	def clear(self):
+		self.keys = array('Q', bytes(KEY_BYTES * self.capacity))
+		self.weights = array('H', bytes(WEIGHT_BYTES * self.capacity))
+		self.values = array('i', bytes(VALUE_BYTES * self.capacity))
+		if self.bloom:
+			self.bloom.clear()
+		self.count = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.evictions_since_rebuild = 0
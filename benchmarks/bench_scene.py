@@ -0,0 +1,357 @@
+'''
+Frame-time benchmark for SeahavenScene.py, run off-device on the headless
+stand-ins for Pythonista's modules in headless_scene.py.
+
+	python benchmarks/bench_scene.py [--deals N] [--storm N] [--json]
+
+Drives a TableNode through set_game() on fresh deals, solved games played
+with scripted drags, long auto-move cascades, undo/redo storms on the
+buttons, the play button's background solve, solution playback and hit
+testing. Reports the CPU time of the main thread per event (so the background
+save writer isn't counted) and the node churn per event: nodes created,
+reparented and actions run. Frames played while the solver thread runs
+(solve_frame) are timed by the wall clock instead, since what they lose is
+time spent waiting for the GIL.
+
+Exits with status 1 if a scripted game doesn't end up won with every card
+shown in place, or if --max-p99-ms is given and any event's p99 is over it.
+'''
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from collections import defaultdict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import headless_scene
+
+headless_scene.install()
+
+from headless_scene import Point, Touch, run, run_frame, snapshot
+from Seahaven import Seahaven
+from Solver import Solver
+from Playback import Playback
+from SeahavenScene import SeahavenScene
+
+# churn counters reported per event
+CHURN_KEYS = ["nodes_created", "add_child", "remove_from_parent", "actions_run"]
+
+# give up draining animations after this many frames
+MAX_DRAIN_FRAMES = 10000
+
+
+def percentile(sorted_values, fraction):
+	index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+	return sorted_values[index]
+
+
+class Recorder (object):
+	'''
+	Times events by name and records the churn of each.
+	'''
+
+	def __init__(self):
+		self.times = defaultdict(list)
+		self.churn = defaultdict(lambda: defaultdict(int))
+
+	def measure(self, name, function, *args, clock=time.thread_time):
+		before = snapshot()
+		start = clock()
+		result = function(*args)
+		self.times[name].append(clock() - start)
+		after = snapshot()
+		for key in CHURN_KEYS:
+			self.churn[name][key] += after[key] - before[key]
+		return result
+
+	def results(self):
+		results = {}
+		for (name, times) in self.times.items():
+			times = sorted(t * 1000 for t in times)
+			count = len(times)
+			results[name] = {
+				"events": count,
+				"mean_ms": statistics.mean(times),
+				"p50_ms": percentile(times, 0.50),
+				"p99_ms": percentile(times, 0.99),
+				"max_ms": times[-1],
+			}
+			for key in CHURN_KEYS:
+				results[name][key] = self.churn[name][key] / count
+		return results
+
+
+class Driver (object):
+	'''
+	Plays scripted input into the scene the way Pythonista would deliver it.
+	'''
+
+	def __init__(self, scene, recorder):
+		self.scene = scene
+		self.table = scene.table
+		self.recorder = recorder
+		self.next_touch_id = 0
+
+	def scene_point(self, point):
+		return self.table.point_to_scene(point)
+
+	def tap(self, name, point):
+		self.next_touch_id += 1
+		touch = Touch(self.scene_point(point), self.next_touch_id)
+		self.recorder.measure(name + "_began", self.scene.touch_began, touch)
+		self.recorder.measure(name + "_ended", self.scene.touch_ended, touch)
+
+	def drag(self, start, end, steps=4):
+		self.next_touch_id += 1
+		touch = Touch(self.scene_point(start), self.next_touch_id)
+		self.recorder.measure("touch_began", self.scene.touch_began, touch)
+		for i in range(1, steps + 1):
+			point = start + (end - start) * (i / steps)
+			touch = Touch(self.scene_point(point), self.next_touch_id, touch.location)
+			self.recorder.measure("touch_moved", self.scene.touch_moved, touch)
+		self.recorder.measure("touch_ended", self.scene.touch_ended, touch)
+
+	def frame(self, name="frame"):
+		self.recorder.measure(name, run_frame, self.scene)
+
+	def drain(self, name="frame"):
+		'''
+		Plays frames until no animation is running or queued.
+		'''
+		frames = 0
+		while self.table.current_animations or self.table.animation_queue:
+			self.frame(name)
+			frames += 1
+			if frames > MAX_DRAIN_FRAMES:
+				raise RuntimeError("animations never finished")
+		return frames
+
+	def card_point(self, slot_index, num_cards):
+		'''
+		Returns a point (in table coordinates) that find_slot_containing_point()
+		maps to the num_cards top cards of slot_index.
+		'''
+		table = self.table
+		position = table.slot_positions[slot_index]
+		if slot_index >= 10:
+			return Point(position.x, position.y)
+		height = len(table.game.slots[slot_index])
+		card_index = height - num_cards
+		y = position.y + table.card_height/2 - (card_index + 0.5)*table.v_gap
+		return Point(position.x, y)
+
+	def drop_point(self, slot_index):
+		position = self.table.slot_positions[slot_index]
+		return Point(position.x, position.y)
+
+	def play_move(self, move):
+		(source, dest, count) = move
+		start = self.card_point(source, count)
+		found = self.table.find_slot_containing_point(start)
+		if found != (source, count):
+			raise RuntimeError("touch at %r finds %r, not %r" % (start, found, (source, count)))
+		self.drag(start, self.drop_point(dest))
+
+
+def is_won(game):
+	return sum(len(game.slot_for_suit(suit)) for suit in range(4)) == 52
+
+
+def layout_matches_game(table):
+	'''
+	Checks that every card node is on the table, where its slot says it is.
+	'''
+	for (slot_index, slot) in enumerate(table.game.slots):
+		for (offset, card) in enumerate(slot):
+			node = table.card_nodes[card]
+			expected = table.card_position_at_slot(slot_index, offset if slot_index < 10 else 0)
+			if node.parent is not table or abs(node.position.x - expected.x) > 0.01 or abs(node.position.y - expected.y) > 0.01:
+				return False
+	return True
+
+
+def solved_deal(first_deal, max_nodes):
+	'''
+	Returns (deal, moves) for the first deal from first_deal with a solution.
+	'''
+	deal = first_deal
+	while True:
+		moves = Solver.from_game(Seahaven(deal=deal), max_nodes=max_nodes).solve()
+		if moves:
+			return (deal, moves)
+		deal += 1
+
+
+def bench_set_game(driver, deals):
+	for deal in deals:
+		game = Seahaven(deal=deal)
+		driver.recorder.measure("set_game", driver.table.set_game, game)
+
+
+def bench_scripted_game(driver, deal, moves):
+	'''
+	Plays moves with drags, letting the animations of each finish. Returns
+	whether the game ended up won, with every card shown in place.
+	'''
+	driver.table.set_game(Seahaven(deal=deal))
+	for move in moves:
+		driver.play_move(move)
+		driver.drain()
+	return is_won(driver.table.game) and layout_matches_game(driver.table)
+
+
+def bench_cascade(driver, rounds):
+	'''
+	From a won game, undo and redo the last move. Winning usually ends with
+	every remaining card going up automatically, so each is a long cascade.
+	Returns the number of animations in the cascade.
+	'''
+	table = driver.table
+	undo_button = table.buttons[0].position
+	redo_button = table.buttons[1].position
+	cascade = 0
+	for _ in range(rounds):
+		driver.tap("undo_tap", undo_button)
+		driver.drain("cascade_frame")
+		history_length = len(table.game.move_history)
+		driver.tap("redo_tap", redo_button)
+		cascade = len(table.game.move_history) - history_length
+		driver.drain("cascade_frame")
+	return cascade
+
+
+def bench_storm(driver, taps):
+	'''
+	Taps undo taps times as fast as frames come, then redo as many times.
+	Each tap fast-forwards whatever the previous one started.
+	'''
+	table = driver.table
+	before = table.game.to_bytes()
+	for (button, name) in [(table.buttons[0], "storm_undo"), (table.buttons[1], "storm_redo")]:
+		for _ in range(taps):
+			driver.tap(name, button.position)
+			driver.frame("storm_frame")
+	driver.drain("storm_frame")
+	return table.game.to_bytes() == before and layout_matches_game(table)
+
+
+def bench_playback(driver, deal, moves, speed):
+	'''
+	Plays moves through Playback, the way the play button does. Returns
+	whether the game ended up won, with every card shown in place.
+	'''
+	table = driver.table
+	table.set_game(Seahaven(deal=deal))
+	table.set_playback_speed(speed)
+	table.playback = Playback(table.game, moves, table.PLAYBACK_CHUNK_SIZE)
+	table.playback.play()
+	frames = 0
+	while table.playback.playing or table.current_animations or table.animation_queue:
+		driver.frame("playback_frame")
+		frames += 1
+		if frames > MAX_DRAIN_FRAMES:
+			raise RuntimeError("playback never finished")
+	return is_won(table.game) and layout_matches_game(table)
+
+
+def bench_solve(driver, deal):
+	'''
+	Presses the play button on a fresh deal and plays frames at 60 per second
+	until the background solve is over. Returns (seconds the solve took,
+	whether it found a solution).
+	'''
+	table = driver.table
+	table.set_game(Seahaven(deal=deal))
+	driver.tap("play_tap", table.play_button.position)
+	start = time.perf_counter()
+	next_frame = start
+	while table.solving or table.pending_solution:
+		driver.recorder.measure("solve_frame", run_frame, driver.scene, clock=time.perf_counter)
+		next_frame += headless_scene.FRAME_INTERVAL
+		time.sleep(max(0.0, next_frame - time.perf_counter()))
+	elapsed = time.perf_counter() - start
+	solved = table.playback is not None
+	table.stop_playback()
+	driver.drain()
+	return (elapsed, solved)
+
+
+def bench_hit_test(driver, points_per_axis):
+	table = driver.table
+	(width, height) = table.size
+	points = [Point(width * (i / points_per_axis - 0.5), height * (j / points_per_axis - 0.5))
+		for i in range(points_per_axis + 1) for j in range(points_per_axis + 1)]
+	for point in points:
+		driver.recorder.measure("find_slot_containing_point", table.find_slot_containing_point, point)
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark SeahavenScene.py frame and event times headlessly.")
+	parser.add_argument("--deals", type=int, default=20, help="number of deals to load with set_game")
+	parser.add_argument("--first-deal", type=int, default=0, help="first deal to try for the scripted game")
+	parser.add_argument("--cascades", type=int, default=5, help="cascade undo/redo rounds")
+	parser.add_argument("--storm", type=int, default=50, help="taps of undo, then redo, in the storm")
+	parser.add_argument("--solve-deals", default="2,5", help="comma-separated deals to press play on")
+	parser.add_argument("--speed", type=float, default=4.0, help="playback speed")
+	parser.add_argument("--max-nodes", type=int, default=200000, help="solver node limit")
+	parser.add_argument("--max-p99-ms", type=float, default=None, help="fail if any event's p99 is higher")
+	parser.add_argument("--json", action="store_true", help="print the results as JSON")
+	args = parser.parse_args()
+
+	# SeahavenScene saves to the current directory
+	os.chdir(tempfile.mkdtemp(prefix="bench_scene_"))
+
+	recorder = Recorder()
+	scene = recorder.measure("setup", run, SeahavenScene())
+	driver = Driver(scene, recorder)
+	(deal, moves) = solved_deal(args.first_deal, args.max_nodes)
+
+	bench_set_game(driver, range(args.deals))
+	won = bench_scripted_game(driver, deal, moves)
+	cascade = bench_cascade(driver, args.cascades) if won else 0
+	storm_ok = bench_storm(driver, args.storm) if won else False
+	played = bench_playback(driver, deal, moves, args.speed)
+	solves = [(d,) + bench_solve(driver, d) for d in (int(d) for d in args.solve_deals.split(",") if d)]
+	bench_hit_test(driver, 40)
+	scene.stop()
+
+	results = recorder.results()
+	if args.json:
+		print(json.dumps(results, indent=1, sort_keys=True))
+	else:
+		print("deal %d, %d moves, last move cascades %d auto moves" % (deal, len(moves), cascade))
+		for (solve_deal, elapsed, solved) in solves:
+			print("play button on deal %d: solve %s in %.2f s" % (solve_deal, "found" if solved else "gave up", elapsed))
+		print("%-27s %7s %8s %8s %8s %8s %7s %7s %7s %7s" % ("event", "count", "mean ms", "p50 ms", "p99 ms",
+			"max ms", "created", "added", "removed", "actions"))
+		for (name, r) in sorted(results.items()):
+			print("%-27s %7d %8.3f %8.3f %8.3f %8.3f %7.1f %7.1f %7.1f %7.1f" % (name, r["events"], r["mean_ms"],
+				r["p50_ms"], r["p99_ms"], r["max_ms"], r["nodes_created"], r["add_child"],
+				r["remove_from_parent"], r["actions_run"]))
+
+	failed = False
+	if not won or not played:
+		print("FAIL: scripted game or playback did not end up won with every card in place")
+		failed = True
+	if won and not storm_ok:
+		print("FAIL: undo/redo storm did not return to the same position with every card in place")
+		failed = True
+	if args.max_p99_ms is not None:
+		for (name, r) in sorted(results.items()):
+			if name != "setup" and r["p99_ms"] > args.max_p99_ms:
+				print("FAIL: %s p99 %.3f ms is over %.3f ms" % (name, r["p99_ms"], args.max_p99_ms))
+				failed = True
+	return 1 if failed else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,143 @@
+'''
+Load test for SeahavenServer.py. Starts a server on a temporary unix socket
+(unless --socket is given), opens many sessions spread over a pool of
+connections, plays random moves, undos, redos and hints in all of them at
+once, and reports request latency percentiles, overall and per command.
+
+	python benchmarks/bench_server.py [--sessions N] [--connections N] [--requests N] [--hints F]
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(sorted_values, fraction):
+	index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+	return sorted_values[index]
+
+
+def random_request(rng, hint_fraction):
+	r = rng.random()
+	if r < hint_fraction:
+		return {"cmd": "hint"}
+	r = rng.random()
+	if r < 0.1:
+		return {"cmd": "undo"}
+	if r < 0.15:
+		return {"cmd": "redo"}
+	if r < 0.2:
+		return {"cmd": "state"}
+	return {"cmd": "move", "source": rng.randrange(14), "dest": rng.randrange(14), "count": 1}
+
+
+async def run_connection(socket_path, session_ids, requests_per_session, hint_fraction, latencies, seed):
+	'''
+	Plays every session in session_ids over one connection: first a new game
+	for each, then requests_per_session random requests per session, taking
+	the sessions in turn.
+	'''
+	rng = random.Random(seed)
+	(reader, writer) = await asyncio.open_unix_connection(socket_path, limit=2**20)
+	request_id = 0
+
+	async def send(request):
+		nonlocal request_id
+		request_id += 1
+		request["id"] = request_id
+		start = time.perf_counter()
+		writer.write(json.dumps(request).encode() + b"\n")
+		reply = json.loads(await reader.readline())
+		latencies.append((request["cmd"], time.perf_counter() - start))
+		if reply.get("id") != request_id:
+			raise RuntimeError("reply out of order: %r" % reply)
+		return reply
+
+	for session_id in session_ids:
+		await send({"session": session_id, "cmd": "new_game", "deal": rng.randrange(1000)})
+	for _ in range(requests_per_session):
+		for session_id in session_ids:
+			request = random_request(rng, hint_fraction)
+			request["session"] = session_id
+			await send(request)
+
+	writer.close()
+	await writer.wait_closed()
+
+
+async def run_load(socket_path, num_sessions, num_connections, requests_per_session, hint_fraction):
+	session_ids = ["s%d" % i for i in range(num_sessions)]
+	latencies = []
+	tasks = []
+	for c in range(num_connections):
+		tasks.append(run_connection(socket_path, session_ids[c::num_connections], requests_per_session,
+			hint_fraction, latencies, c))
+	start = time.perf_counter()
+	await asyncio.gather(*tasks)
+	return (latencies, time.perf_counter() - start)
+
+
+def wait_for_socket(socket_path, process, timeout=10.0):
+	deadline = time.time() + timeout
+	while not os.path.exists(socket_path):
+		if process.poll() is not None or time.time() > deadline:
+			raise RuntimeError("server did not start")
+		time.sleep(0.05)
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Load test the Seahaven game server.")
+	parser.add_argument("--sessions", type=int, default=10000, help="number of concurrent sessions")
+	parser.add_argument("--connections", type=int, default=200, help="number of client connections")
+	parser.add_argument("--requests", type=int, default=5, help="random requests per session after new_game")
+	parser.add_argument("--hints", type=float, default=0.002, help="fraction of requests that ask for a hint")
+	parser.add_argument("--socket", default=None, help="use a server already listening on this socket")
+	parser.add_argument("--max-active", type=int, default=1000, help="--max-active for the started server")
+	args = parser.parse_args()
+
+	server = None
+	temp_dir = tempfile.TemporaryDirectory()
+	socket_path = args.socket
+	if socket_path is None:
+		socket_path = os.path.join(temp_dir.name, "seahaven.sock")
+		server = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "SeahavenServer.py"),
+			"--socket", socket_path,
+			"--data-dir", os.path.join(temp_dir.name, "sessions"),
+			"--max-active", str(args.max_active)])
+		wait_for_socket(socket_path, server)
+
+	try:
+		(latencies, elapsed) = asyncio.run(run_load(socket_path, args.sessions, args.connections, args.requests,
+			args.hints))
+	finally:
+		if server:
+			server.terminate()
+			server.wait()
+		temp_dir.cleanup()
+
+	print("sessions %d, connections %d, requests %d in %.2f s (%.0f requests/s)" % (
+		args.sessions, args.connections, len(latencies), elapsed, len(latencies) / elapsed))
+	by_command = {"all": sorted(latency for (_, latency) in latencies)}
+	for (cmd, latency) in latencies:
+		by_command.setdefault(cmd, []).append(latency)
+	for (cmd, times) in sorted(by_command.items()):
+		times.sort()
+		print("%-9s %7d requests   p50 %8.2f ms   p99 %8.2f ms   max %8.2f ms   mean %8.2f ms" % (cmd, len(times),
+			percentile(times, 0.50) * 1000,
+			percentile(times, 0.99) * 1000,
+			times[-1] * 1000,
+			statistics.mean(times) * 1000))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,79 @@
+'''
+Measures how long a fresh worker process takes to import the Seahaven engine
+and deal its first game, and checks that the import pulls in no Pythonista
+modules.
+
+	python benchmarks/bench_startup.py [--runs N] [--max-import-ms MS]
+
+Exits with status 1 if a platform module was imported, or if the median
+import time is over --max-import-ms.
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Pythonista-only modules the engine must never import
+PLATFORM_MODULES = ["console", "scene", "ui", "sound"]
+
+# Run in a fresh interpreter for each sample, so every import is a cold one.
+WORKER_SCRIPT = '''
+import json, sys, time
+before = set(sys.modules)
+t0 = time.perf_counter()
+import Seahaven
+t1 = time.perf_counter()
+game = Seahaven.Seahaven(deal=0)
+t2 = time.perf_counter()
+print(json.dumps({
+	"import": t1 - t0,
+	"first_game": t2 - t1,
+	"modules": sorted(set(sys.modules) - before),
+}))
+'''
+
+
+def run_worker():
+	start = time.perf_counter()
+	output = subprocess.check_output([sys.executable, "-c", WORKER_SCRIPT], cwd=REPO_DIR)
+	result = json.loads(output)
+	result["process"] = time.perf_counter() - start
+	return result
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark engine import and cold start.")
+	parser.add_argument("--runs", type=int, default=20, help="number of fresh processes to time")
+	parser.add_argument("--max-import-ms", type=float, default=None, help="fail if the median import time is higher")
+	args = parser.parse_args()
+
+	results = [run_worker() for _ in range(args.runs)]
+
+	for key in ["import", "first_game", "process"]:
+		times = [r[key] * 1000 for r in results]
+		print("%-10s median %7.2f ms   min %7.2f ms   max %7.2f ms" % (key, statistics.median(times), min(times), max(times)))
+
+	modules = results[0]["modules"]
+	print("modules imported by the engine (%d): %s" % (len(modules), ", ".join(modules)))
+
+	failed = False
+	platform_modules = [m for m in PLATFORM_MODULES if m in modules]
+	if platform_modules:
+		print("FAIL: engine imported platform modules: %s" % ", ".join(platform_modules))
+		failed = True
+	median_import_ms = statistics.median(r["import"] * 1000 for r in results)
+	if args.max_import_ms is not None and median_import_ms > args.max_import_ms:
+		print("FAIL: median import time %.2f ms is over %.2f ms" % (median_import_ms, args.max_import_ms))
+		failed = True
+	return 1 if failed else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
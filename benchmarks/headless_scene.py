@@ -0,0 +1,511 @@
+'''
+Headless stand-ins for Pythonista's scene, ui and sound modules, just complete
+enough to run SeahavenScene.py off-device. Nothing is drawn. Nodes keep their
+position, scale, children and running actions, and STATS counts node
+creation, reparenting and actions, so benchmarks can measure churn.
+
+	import headless_scene
+	headless_scene.install()		# before importing SeahavenScene
+	from SeahavenScene import SeahavenScene
+	scene = headless_scene.run(SeahavenScene())
+	headless_scene.run_frame(scene)
+
+install() only registers the stand-ins in sys.modules for the running
+process; it is meant for benchmarks, never for the app itself.
+'''
+
+import sys
+import types
+
+from collections import Counter
+
+
+# counters of node and action churn; see snapshot()
+STATS = Counter()
+
+# Sizes of the images SeahavenScene.py uses, by name prefix. The real card
+# images are about this size; only their proportions matter for layout.
+TEXTURE_SIZES = {
+	'card:': (140.0, 190.0),
+	'iow:': (256.0, 256.0),
+	'emj:': (64.0, 64.0),
+}
+
+FRAME_INTERVAL = 1/60
+
+# nodes with actions running
+active_nodes = {}
+
+
+def snapshot():
+	return Counter(STATS)
+
+
+class Point (object):
+
+	def __init__(self, x=0.0, y=0.0):
+		self.x = x
+		self.y = y
+
+	def __iter__(self):
+		yield self.x
+		yield self.y
+
+	def __getitem__(self, index):
+		return (self.x, self.y)[index]
+
+	def __len__(self):
+		return 2
+
+	def __add__(self, other):
+		(x, y) = other
+		return Point(self.x + x, self.y + y)
+
+	def __sub__(self, other):
+		(x, y) = other
+		return Point(self.x - x, self.y - y)
+
+	def __mul__(self, factor):
+		return Point(self.x * factor, self.y * factor)
+
+	def __truediv__(self, divisor):
+		return Point(self.x / divisor, self.y / divisor)
+
+	def __eq__(self, other):
+		return tuple(self) == tuple(other)
+
+	def __repr__(self):
+		return "Point(%.2f, %.2f)" % (self.x, self.y)
+
+
+Vector2 = Point
+
+
+class Size (Point):
+
+	def __init__(self, w=0.0, h=0.0):
+		super().__init__(w, h)
+
+	@property
+	def w(self):
+		return self.x
+
+	@property
+	def h(self):
+		return self.y
+
+	width = w
+	height = h
+
+	def __truediv__(self, divisor):
+		return Size(self.x / divisor, self.y / divisor)
+
+	def __repr__(self):
+		return "Size(%.2f, %.2f)" % (self.x, self.y)
+
+
+class Rect (object):
+
+	def __init__(self, x=0.0, y=0.0, w=0.0, h=0.0):
+		self.x = x
+		self.y = y
+		self.w = w
+		self.h = h
+
+	@property
+	def width(self):
+		return self.w
+
+	@property
+	def height(self):
+		return self.h
+
+	def __contains__(self, point):
+		(x, y) = point
+		return self.x <= x < self.x + self.w and self.y <= y < self.y + self.h
+
+	def __iter__(self):
+		return iter((self.x, self.y, self.w, self.h))
+
+	def __repr__(self):
+		return "Rect(%.2f, %.2f, %.2f, %.2f)" % (self.x, self.y, self.w, self.h)
+
+
+class Texture (object):
+
+	def __init__(self, name):
+		STATS['textures_created'] += 1
+		self.name = name
+		size = (0.0, 0.0)
+		for (prefix, prefix_size) in TEXTURE_SIZES.items():
+			if name.startswith(prefix):
+				size = prefix_size
+		self.size = Size(*size)
+
+
+class Action (object):
+	'''
+	An action is a description; running one on a node makes a RunningAction.
+	Only the kinds SeahavenScene.py uses, plus a couple of neighbours, exist.
+	'''
+
+	def __init__(self, kind, args, duration=0.0, children=()):
+		self.kind = kind
+		self.args = args
+		self.duration = duration
+		self.children = children
+
+	@classmethod
+	def move_by(cls, dx, dy, duration=0.5, timing_mode=None):
+		return cls('move_by', (dx, dy), duration)
+
+	@classmethod
+	def move_to(cls, x, y, duration=0.5, timing_mode=None):
+		return cls('move_to', (x, y), duration)
+
+	@classmethod
+	def wait(cls, duration):
+		return cls('wait', (), duration)
+
+	@classmethod
+	def call(cls, function):
+		return cls('call', (function,))
+
+	@classmethod
+	def sequence(cls, *actions):
+		if len(actions) == 1 and isinstance(actions[0], (list, tuple)):
+			actions = actions[0]
+		return cls('sequence', (), children=tuple(actions))
+
+	@classmethod
+	def group(cls, *actions):
+		if len(actions) == 1 and isinstance(actions[0], (list, tuple)):
+			actions = actions[0]
+		return cls('group', (), children=tuple(actions))
+
+
+class RunningAction (object):
+
+	def __init__(self, action):
+		self.action = action
+		self.elapsed = 0.0
+		self.start = None
+		self.index = 0
+		self.child = None
+		self.children = None
+
+	def advance(self, node, dt):
+		'''
+		Runs the action for dt seconds. Returns the time left over if it
+		finished, or None if it is still running.
+		'''
+		action = self.action
+		if action.kind == 'call':
+			action.args[0]()
+			return dt
+		if action.kind == 'sequence':
+			while self.index < len(action.children):
+				if self.child is None:
+					self.child = RunningAction(action.children[self.index])
+				dt = self.child.advance(node, dt)
+				if dt is None:
+					return None
+				self.index += 1
+				self.child = None
+			return dt
+		if action.kind == 'group':
+			if self.children is None:
+				self.children = [RunningAction(child) for child in action.children]
+			left = [child.advance(node, dt) for child in self.children]
+			self.children = [child for (child, l) in zip(self.children, left) if l is None]
+			if self.children:
+				return None
+			return min(left, default=dt)
+
+		previous = min(self.elapsed / action.duration, 1.0) if action.duration else 0.0
+		self.elapsed += dt
+		progress = min(self.elapsed / action.duration, 1.0) if action.duration else 1.0
+		if action.kind == 'move_by':
+			(dx, dy) = action.args
+			node.position = node.position + (dx * (progress - previous), dy * (progress - previous))
+		elif action.kind == 'move_to':
+			if self.start is None:
+				self.start = node.position
+			(x, y) = action.args
+			node.position = Point(self.start.x + (x - self.start.x) * progress, self.start.y + (y - self.start.y) * progress)
+		if progress < 1.0:
+			return None
+		return self.elapsed - action.duration
+
+
+class Node (object):
+
+	def __init__(self, position=(0, 0), z_position=0.0, scale=1.0, x_scale=None, y_scale=None, alpha=1.0,
+			speed=1.0, parent=None):
+		STATS['nodes_created'] += 1
+		self.position = position
+		self.z_position = z_position
+		self.x_scale = scale if x_scale is None else x_scale
+		self.y_scale = scale if y_scale is None else y_scale
+		self.alpha = alpha
+		self.speed = speed
+		self.rotation = 0.0
+		self.children = []
+		self.parent = None
+		self.actions = []
+		if parent is not None:
+			parent.add_child(self)
+
+	@property
+	def position(self):
+		return self._position
+
+	@position.setter
+	def position(self, position):
+		self._position = Point(*position)
+
+	@property
+	def scale(self):
+		return self.x_scale
+
+	@scale.setter
+	def scale(self, scale):
+		self.x_scale = scale
+		self.y_scale = scale
+
+	@property
+	def scene(self):
+		node = self
+		while node.parent is not None:
+			node = node.parent
+		return node if isinstance(node, Scene) else None
+
+	@property
+	def frame(self):
+		return Rect(self.position.x, self.position.y, 0.0, 0.0)
+
+	@property
+	def bbox(self):
+		return self.frame
+
+	def add_child(self, node):
+		if node.parent is not None:
+			node.remove_from_parent()
+		STATS['add_child'] += 1
+		node.parent = self
+		self.children.append(node)
+
+	def remove_from_parent(self):
+		if self.parent is None:
+			return
+		STATS['remove_from_parent'] += 1
+		self.parent.children.remove(self)
+		self.parent = None
+
+	def run_action(self, action, key=None):
+		STATS['actions_run'] += 1
+		self.actions.append(RunningAction(action))
+		active_nodes[id(self)] = self
+
+	def remove_all_actions(self):
+		if self.actions:
+			STATS['actions_removed'] += len(self.actions)
+			self.actions = []
+			active_nodes.pop(id(self), None)
+
+	def ancestors(self):
+		'''
+		Returns this node and its parents, up to but not including the scene.
+		'''
+		chain = []
+		node = self
+		while node is not None and not isinstance(node, Scene):
+			chain.append(node)
+			node = node.parent
+		return chain
+
+	def point_from_scene(self, point):
+		# A node's children are placed relative to its position, in its scale.
+		(x, y) = point
+		for node in reversed(self.ancestors()):
+			x = (x - node.position.x) / node.x_scale
+			y = (y - node.position.y) / node.y_scale
+		return Point(x, y)
+
+	def point_to_scene(self, point):
+		(x, y) = point
+		for node in self.ancestors():
+			x = x * node.x_scale + node.position.x
+			y = y * node.y_scale + node.position.y
+		return Point(x, y)
+
+
+class SpriteNode (Node):
+
+	def __init__(self, texture=None, color='white', size=None, **kwargs):
+		super().__init__(**kwargs)
+		if isinstance(texture, str):
+			texture = Texture(texture)
+		self._texture = texture
+		self.color = color
+		if size is None:
+			size = texture.size if texture is not None else (0.0, 0.0)
+		self.size = Size(*size)
+
+	@property
+	def texture(self):
+		return self._texture
+
+	@texture.setter
+	def texture(self, texture):
+		STATS['texture_changes'] += 1
+		self._texture = texture
+
+	@property
+	def frame(self):
+		w = self.size.w * self.x_scale
+		h = self.size.h * self.y_scale
+		return Rect(self.position.x - w/2, self.position.y - h/2, w, h)
+
+
+class ShapeNode (SpriteNode):
+
+	def __init__(self, path=None, fill_color='white', stroke_color='clear', shadow=None, **kwargs):
+		size = (path.width, path.height) if path is not None else (0.0, 0.0)
+		super().__init__(None, fill_color, size, **kwargs)
+		self.path = path
+		self.fill_color = fill_color
+		self.stroke_color = stroke_color
+
+
+class LabelNode (SpriteNode):
+
+	def __init__(self, text='', font=('Helvetica', 20), **kwargs):
+		super().__init__(None, **kwargs)
+		self.text = text
+		self.font = font
+
+
+class Scene (Node):
+
+	def __init__(self):
+		super().__init__()
+		self.size = Size(1024.0, 768.0)
+		self.t = 0.0
+		self.dt = 0.0
+
+	@property
+	def bounds(self):
+		return Rect(0.0, 0.0, self.size.w, self.size.h)
+
+	def setup(self):
+		pass
+
+	def update(self):
+		pass
+
+	def did_change_size(self):
+		pass
+
+	def pause(self):
+		pass
+
+	def resume(self):
+		pass
+
+	def stop(self):
+		pass
+
+	def touch_began(self, touch):
+		pass
+
+	def touch_moved(self, touch):
+		pass
+
+	def touch_ended(self, touch):
+		pass
+
+
+class Touch (object):
+
+	def __init__(self, location, touch_id, prev_location=None):
+		self.location = Point(*location)
+		self.prev_location = self.location if prev_location is None else Point(*prev_location)
+		self.touch_id = touch_id
+		self.timestamp = 0.0
+
+
+def run(scene, orientation=None, frame_interval=1, anti_alias=False, show_fps=False, multi_touch=True,
+		size=(1024.0, 768.0)):
+	'''
+	Sets scene up at size and returns it. Nothing runs until run_frame() is
+	called.
+	'''
+	scene.size = Size(*size)
+	scene.setup()
+	return scene
+
+
+def run_frame(scene, dt=FRAME_INTERVAL):
+	'''
+	Plays one frame: the scene's update(), then every running action, as
+	Pythonista does.
+	'''
+	scene.t += dt
+	scene.dt = dt
+	scene.update()
+	for node in list(active_nodes.values()):
+		for running in list(node.actions):
+			# an earlier action this frame may have removed this one
+			if running not in node.actions:
+				continue
+			if running.advance(node, dt) is not None and running in node.actions:
+				node.actions.remove(running)
+		if not node.actions:
+			active_nodes.pop(id(node), None)
+
+
+class Path (object):
+
+	def __init__(self, width=0.0, height=0.0):
+		self.width = width
+		self.height = height
+		self.line_width = 1.0
+
+	@classmethod
+	def rect(cls, x, y, w, h):
+		return cls(w, h)
+
+	@classmethod
+	def rounded_rect(cls, x, y, w, h, corner_radius):
+		return cls(w, h)
+
+	@classmethod
+	def oval(cls, x, y, w, h):
+		return cls(w, h)
+
+	def set_line_dash(self, sequence, phase=0.0):
+		self.line_dash = sequence
+
+
+def play_effect(name, volume=1.0, pitch=1.0, pan=0.0, looping=False):
+	STATS['sounds'] += 1
+
+
+def install():
+	'''
+	Registers the stand-ins as the scene, ui and sound modules of this process.
+	'''
+	scene_names = ['Point', 'Vector2', 'Size', 'Rect', 'Texture', 'Action', 'Node', 'SpriteNode',
+		'ShapeNode', 'LabelNode', 'Scene', 'Touch', 'run']
+	modules = {
+		'scene': scene_names,
+		'ui': ['Path'],
+		'sound': ['play_effect'],
+	}
+	for (name, names) in modules.items():
+		module = types.ModuleType(name, "Headless stand-in for Pythonista's %s module." % name)
+		for attribute in names:
+			setattr(module, attribute, globals()[attribute])
+		module.__all__ = names
+		sys.modules[name] = module